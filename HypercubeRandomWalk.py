@@ -4,49 +4,400 @@ Created on Thu Feb 10 10:41:43 2022
 
 @author: dtket
 """
+import math
+import multiprocessing
+import warnings
+from fractions import Fraction
+
 import numpy as np      # if using numpy in cpython
 
-def TDM(a, b, c, d):
-    n = len(a)
-    ac, bc, cc, dc = map(np.array, (a, b, c, d))
-    xc = []
-    for j in range(1, n):
-        if(bc[j - 1] == 0):
-            ier = 1
+def TDM(a, b, c, d, backend="thomas"):
+    """
+    Solves tridiagonal systems with the Thomas algorithm.
+    a is the sub-diagonal (a[0] unused), b the diagonal, c the super-diagonal
+    and d the right-hand side; the system size is len(a) and any trailing
+    entries of c and d are ignored, with d's returned unchanged.
+    Passing 2-D (batch, n) arrays solves every row at once; any 1-D argument
+    is shared by every system of the batch. backend="lapack" solves each
+    system with scipy's banded LAPACK solver instead.
+    Raises ValueError on mismatched shapes and np.linalg.LinAlgError on a
+    zero pivot.
+    """
+    ac, bc, cc, dc = (np.array(v, dtype=float) for v in (a, b, c, d))
+    for name, v in zip("abcd", (ac, bc, cc, dc)):
+        if v.ndim not in (1, 2):
+            raise ValueError(f"TDM: {name} must be 1-D or 2-D (batch, n), got shape {v.shape}")
+    batches = {v.shape[0] for v in (ac, bc, cc, dc) if v.ndim == 2}
+    if len(batches) > 1:
+        raise ValueError(f"TDM: batch sizes differ: a {ac.shape}, b {bc.shape}, c {cc.shape}, d {dc.shape}")
+    single = not batches
+    batch = batches.pop() if batches else 1
+    n = ac.shape[-1]
+    for name, v in zip("bcd", (bc, cc, dc)):
+        if v.shape[-1] < n:
+            raise ValueError(f"TDM: {name} has {v.shape[-1]} entries per system, fewer than len(a) = {n}")
+    ac, bc, cc, dc = (np.broadcast_to(v, (batch, v.shape[-1])).copy() for v in (ac, bc, cc, dc))
+    if backend == "lapack":
+        dc[:, :n] = _tdm_banded(ac[:, :n], bc[:, :n], cc[:, :n], dc[:, :n])
+    elif backend == "thomas":
+        for j in range(1, n):
+            if np.any(bc[:, j - 1] == 0):
+                raise np.linalg.LinAlgError(f"TDM: zero pivot in row {j - 1}")
+            ac[:, j] = ac[:, j]/bc[:, j-1]
+            bc[:, j] = bc[:, j] - ac[:, j]*cc[:, j-1]
+            dc[:, j] = dc[:, j] - ac[:, j]*dc[:, j-1]
+        if np.any(bc[:, n - 1] == 0):
+            raise np.linalg.LinAlgError(f"TDM: zero pivot in row {n - 1}")
+        dc[:, n-1] = dc[:, n-1]/bc[:, n-1]
+        for j in range(n-2, -1, -1):
+            dc[:, j] = (dc[:, j] - cc[:, j]*dc[:, j+1])/bc[:, j]
+    else:
+        raise ValueError(f"TDM: unknown backend {backend!r}")
+    return dc[0] if single else dc
+
+def _tdm_banded(a, b, c, d):
+    from scipy.linalg import solve_banded
+    n = a.shape[-1]
+    x = np.empty_like(d)
+    ab = np.zeros((3, n))
+    for k in range(d.shape[0]):
+        ab[0, 1:] = c[k, :n-1]
+        ab[1, :] = b[k]
+        ab[2, :n-1] = a[k, 1:]
+        try:
+            x[k] = solve_banded((1, 1), ab, d[k])
+        except np.linalg.LinAlgError as e:
+            raise np.linalg.LinAlgError(f"TDM: singular system {k}: {e}") from None
+    return x
+
+# Expected hitting times of the lumped walk on the n-cube, where level i is
+# the Hamming distance from the start and the walk steps to i-1 with
+# probability i/n and to i+1 with probability (n-i)/n. Level n (the
+# antipode) is absorbing; these are the same numbers TDM returns for the
+# driver's system below.
+#
+# The time to step from level i to i+1 satisfies T_0 = 1 and
+# T_i = (n + i*T_{i-1})/(n - i), and the antipodal time from level 0 has the
+# closed form H(n) = n * sum_{j=1}^{n} 2^(j-1)/j.
+#
+# mode selects the arithmetic: "float", "exact" (fractions.Fraction) or
+# "log" (natural logarithms, which never overflow).
+
+MODES = ("float", "exact", "log")
+
+def _check_mode(mode):
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+
+def _logaddexp(p, q):
+    if p < q:
+        p, q = q, p
+    if q == -math.inf:
+        return p
+    return p + math.log1p(math.exp(q - p))
+
+def hitting_times(n, mode="float"):
+    """
+    Expected time to reach level n from each level 0..n, as n+1 values.
+    """
+    _check_mode(mode)
+    if n < 1:
+        raise ValueError("n must be at least 1")
+    if mode == "exact":
+        T = [Fraction(1)]
+        for i in range(1, n):
+            T.append((n + i*T[-1])/Fraction(n - i))
+        x = [Fraction(0)]
+        for t in reversed(T):
+            x.append(x[-1] + t)
+        return x[::-1]
+    if mode == "float":
+        T = np.empty(n)
+        T[0] = 1.0
+        for i in range(1, n):
+            T[i] = (n + i*T[i-1])/(n - i)
+        x = np.zeros(n + 1)
+        x[:n] = np.cumsum(T[::-1])[::-1]
+        return x
+    logT = np.empty(n)
+    logT[0] = 0.0
+    for i in range(1, n):
+        logT[i] = _logaddexp(math.log(n), math.log(i) + logT[i-1]) - math.log(n - i)
+    x = np.full(n + 1, -math.inf)
+    x[:n] = np.logaddexp.accumulate(logT[::-1])[::-1]
+    return x
+
+def iter_antipodal_hitting_times(n_start=1, n_stop=None, mode="float"):
+    """
+    Yields (n, H(n)) for n = n_start, n_start+1, ... up to but excluding
+    n_stop (forever if None), updating the closed-form sum in O(1) per n.
+    """
+    _check_mode(mode)
+    if n_start < 1:
+        raise ValueError("n_start must be at least 1")
+    if mode == "exact":
+        total = sum((Fraction(2**(j-1), j) for j in range(1, n_start)), Fraction(0))
+    elif mode == "float":
+        # numpy scalars, so large n overflows to inf instead of raising
+        # OverflowError; the overflow is reported once, below.
+        total = np.float64(0.0)
+        with np.errstate(over="ignore"):
+            for j in range(1, n_start):
+                total += np.ldexp(1.0, j - 1)/j
+        overflowed = False
+    else:
+        total = -math.inf
+        for j in range(1, n_start):
+            total = _logaddexp(total, (j - 1)*math.log(2) - math.log(j))
+    n = n_start
+    while n_stop is None or n < n_stop:
+        if mode == "exact":
+            total += Fraction(2**(n-1), n)
+            yield n, n*total
+        elif mode == "float":
+            with np.errstate(over="ignore"):
+                total += np.ldexp(1.0, n - 1)/n
+                value = float(n*total)
+            if value == math.inf and not overflowed:
+                overflowed = True
+                warnings.warn(f"H({n}) overflows float64 and is returned as inf from here on; "
+                              "use mode='log' or mode='exact'", RuntimeWarning, stacklevel=2)
+            yield n, value
+        else:
+            total = _logaddexp(total, (n - 1)*math.log(2) - math.log(n))
+            yield n, math.log(n) + total
+        n += 1
+
+def antipodal_hitting_time(n, mode="float"):
+    """
+    Expected time for the walk on the n-cube to first reach the antipode.
+    """
+    for _, value in iter_antipodal_hitting_times(n, n + 1, mode):
+        pass
+    return value
+
+# Monte Carlo hitting times on the implicit n-cube. Vertices are integer IDs
+# stored as little-endian uint64 words, so n is not limited to 64, and a step
+# flips one uniformly chosen bit; no matrix is ever built. Each walker keeps
+# its ID XOR the target, whose popcount is the Hamming distance to the
+# target, and is absorbed once that distance is at most radius.
+# Walkers are simulated in shards, each with its own SeedSequence stream,
+# optionally across a process pool, and every finished shard is folded into
+# a StreamingHistogram so no individual walk is kept.
+
+class StreamingHistogram:
+    """
+    Histogram of non-negative integer times with a fixed number of equal-width
+    bins starting at 0. The width doubles (merging bin pairs) whenever a time
+    falls beyond the last bin. Count, mean and variance are kept exactly, and
+    censored walkers (not absorbed within max_steps) are counted separately.
+    """
+
+    def __init__(self, bins=1024):
+        if bins < 2 or bins % 2:
+            raise ValueError("bins must be an even number of at least 2")
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.width = 1
+        self.count = 0
+        self.censored = 0
+        self.total = 0
+        self.total_sq = 0.0
+        self.max = None
+
+    def _grow(self, width):
+        bins = self.counts.shape[0]
+        while self.width < width:
+            merged = self.counts[0::2] + self.counts[1::2]
+            self.counts = np.concatenate([merged, np.zeros(bins//2, dtype=np.int64)])
+            self.width *= 2
+
+    def add(self, times):
+        """
+        Adds an array of hitting times, where -1 marks a censored walker.
+        """
+        times = np.asarray(times, dtype=np.int64)
+        self.censored += int(np.count_nonzero(times < 0))
+        times = times[times >= 0]
+        if times.size == 0:
             return
-        ac[j] = ac[j]/bc[j-1]
-        bc[j] = bc[j] - ac[j]*cc[j-1]
-    if(b[n-1] == 0):
-        ier = 1
+        top = int(times.max())
+        bins = self.counts.shape[0]
+        while top >= bins*self.width:
+            self._grow(2*self.width)
+        self.counts += np.bincount(times//self.width, minlength=bins)
+        self.count += int(times.size)
+        self.total += int(times.sum())
+        self.total_sq += float(np.dot(times.astype(float), times))
+        self.max = top if self.max is None else max(self.max, top)
+
+    def merge(self, other):
+        """
+        Folds another histogram with the same number of bins into this one.
+        """
+        if other.counts.shape != self.counts.shape:
+            raise ValueError("histograms must have the same number of bins")
+        self._grow(other.width)
+        counts = other.counts
+        width = other.width
+        while width < self.width:
+            counts = np.concatenate([counts[0::2] + counts[1::2], np.zeros(counts.shape[0]//2, dtype=np.int64)])
+            width *= 2
+        self.counts += counts
+        self.count += other.count
+        self.censored += other.censored
+        self.total += other.total
+        self.total_sq += other.total_sq
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def mean(self):
+        return self.total/self.count if self.count else math.nan
+
+    def var(self):
+        if self.count < 2:
+            return math.nan
+        mean = self.mean()
+        return max(self.total_sq/self.count - mean*mean, 0.0)*self.count/(self.count - 1)
+
+    def quantile(self, q):
+        """
+        Quantiles of the absorbed walkers' times, interpolated within a bin.
+        """
+        q = np.asarray(q, dtype=float)
+        if self.count == 0:
+            return np.full(q.shape, math.nan)
+        cum = np.cumsum(self.counts)
+        target = q*self.count
+        i = np.minimum(np.searchsorted(cum, target, side="left"), len(cum) - 1)
+        before = np.where(i > 0, cum[i - 1], 0)
+        inside = self.counts[i]
+        frac = np.where(inside > 0, (target - before)/np.maximum(inside, 1), 0.0)
+        return np.minimum((i + np.clip(frac, 0, 1))*self.width, self.max)
+
+    def edges(self):
+        return np.arange(self.counts.shape[0] + 1)*self.width
+
+    def summary(self, quantiles=(0.5, 0.9, 0.99, 0.999)):
+        return {
+            "count": self.count,
+            "censored": self.censored,
+            "mean": self.mean(),
+            "std": math.sqrt(self.var()) if self.count > 1 else math.nan,
+            "max": self.max,
+            "quantiles": dict(zip(quantiles, self.quantile(quantiles).tolist())),
+        }
+
+def _words(v, n):
+    v = int(v)
+    if v < 0 or v.bit_length() > n:
+        raise ValueError(f"vertex {v} is not a vertex of the {n}-cube")
+    return np.frombuffer(v.to_bytes(8*((n + 63)//64), "little"), dtype="<u8").astype(np.uint64)
+
+def walk_hitting_times(n, count, start=0, target=None, radius=0, max_steps=None, rng=None):
+    """
+    Simulates count independent walkers on the n-cube from start and returns
+    the step at which each first comes within Hamming distance radius of
+    target (the antipode of start by default), or -1 if that did not happen
+    within max_steps.
+    """
+    if n < 1:
+        raise ValueError("n must be at least 1")
+    if target is None:
+        target = int(start) ^ ((1 << n) - 1)
+    rng = np.random.default_rng(rng)
+    diff = _words(start, n) ^ _words(target, n)
+    x = np.tile(diff, (count, 1))
+    d = np.full(count, bin(int(start) ^ int(target)).count("1"), dtype=np.int64)
+    times = np.full(count, -1, dtype=np.int64)
+    alive = np.arange(count)
+    done = d <= radius
+    times[done] = 0
+    x, d, alive = x[~done], d[~done], alive[~done]
+    if x.shape[1] == 1:
+        # A single word: flip bits in a flat array, without a word index.
+        x = x[:, 0]
+    rows = np.arange(alive.size)
+    step = 0
+    while alive.size and (max_steps is None or step < max_steps):
+        step += 1
+        r = rng.integers(0, n, size=alive.size, dtype=np.uint64)
+        bit = np.left_shift(np.uint64(1), r & np.uint64(63))
+        if x.ndim == 1:
+            x ^= bit
+            d += 1 - 2*((x & bit) == 0)
+        else:
+            word = (r >> np.uint64(6)).astype(np.intp)
+            x[rows, word] ^= bit
+            d += 1 - 2*((x[rows, word] & bit) == 0)
+        done = d <= radius
+        if done.any():
+            times[alive[done]] = step
+            x, d, alive = x[~done], d[~done], alive[~done]
+            rows = np.arange(alive.size)
+    return times
+
+def _walk_shard(task):
+    n, count, start, target, radius, max_steps, seed, bins = task
+    hist = StreamingHistogram(bins)
+    hist.add(walk_hitting_times(n, count, start, target, radius, max_steps, np.random.default_rng(seed)))
+    return hist
+
+def stream_hitting_times(n, walkers, start=0, target=None, radius=0, max_steps=None,
+                         seed=None, processes=None, shard_size=100000, bins=1024):
+    """
+    Simulates walkers in shards of shard_size, each with an independent
+    stream spawned from seed, over a multiprocessing pool when processes > 1.
+    Yields the running StreamingHistogram (the same object, updated) as each
+    shard finishes.
+    """
+    sizes = [min(shard_size, walkers - i) for i in range(0, walkers, shard_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(n, size, start, target, radius, max_steps, s, bins) for size, s in zip(sizes, seeds)]
+    hist = StreamingHistogram(bins)
+    if processes is None or processes <= 1:
+        for task in tasks:
+            hist.merge(_walk_shard(task))
+            yield hist
         return
-    for j in range(1, n):
-        dc[j] = dc[j] - ac[j]*dc[j-1]
-    dc[n-1] = dc[n-1]/bc[n-1]
-    for j in range(n-2, -1, -1):
-        dc[j] = (dc[j] - cc[j]*dc[j+1])/bc[j]
-    return dc
-
-#test case
-#
-a = [-1/3,-2/3,-1]
-b = [1,1,1]
-c = [-1,-2/3,-1/3,0]
-d = [1,1,1,1]
-print(TDM(a,b,c,d))
-
-
-#let n be the number of dimensions
-for n in range(1,15):
-    a = np.zeros(n)
-    b = np.ones(n)
-    c = np.zeros(n+1)
-    d = np.ones(n+1)
-    d[n]=0
-    for i in range(0,n):
-        a[i] = - i/n
-        c[i] = -(n-i)/n
-        
-    print(TDM(a,b,c,d))    
+    with multiprocessing.get_context().Pool(processes) as pool:
+        for part in pool.imap_unordered(_walk_shard, tasks):
+            hist.merge(part)
+            yield hist
+
+def simulate_hitting_times(n, walkers, **kwargs):
+    """
+    The final histogram of stream_hitting_times.
+    """
+    hist = StreamingHistogram(kwargs.get("bins", 1024))
+    for hist in stream_hitting_times(n, walkers, **kwargs):
+        pass
+    return hist
+
+def main():
+    #test case
+    #
+    a = [-1/3,-2/3,-1]
+    b = [1,1,1]
+    c = [-1,-2/3,-1/3,0]
+    d = [1,1,1,1]
+    print(TDM(a,b,c,d))
+
+
+    #let n be the number of dimensions
+    for n in range(1,15):
+        a = np.zeros(n)
+        b = np.ones(n)
+        c = np.zeros(n+1)
+        d = np.ones(n+1)
+        d[n]=0
+        for i in range(0,n):
+            a[i] = - i/n
+            c[i] = -(n-i)/n
+            
+        print(TDM(a,b,c,d))
+
+if __name__ == "__main__":
+    main()
 
 
 
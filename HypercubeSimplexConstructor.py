@@ -4,12 +4,35 @@ Created on Fri Feb 18 16:37:56 2022
 
 @author: dtket
 """
-import scipy.linalg as la
+import collections
+import itertools
+import math
+
+import scipy.sparse as sp
 import numpy as np
-import networkx as nx
-import matplotlib.pyplot as plt
 
-def Hypercube(M,iters):
+# scipy.linalg, scipy.sparse.linalg, networkx and matplotlib are imported
+# where they are used, so importing this module stays cheap.
+
+# backend selects how figures are built: "dense" numpy arrays, "sparse"
+# scipy CSR matrices, or None to follow the input (sparse in, sparse out).
+
+def _sparse(M, backend):
+    if backend is None:
+        return sp.issparse(M)
+    if backend not in ("dense", "sparse"):
+        raise ValueError(f"backend must be 'dense' or 'sparse', got {backend!r}")
+    return backend == "sparse"
+
+def Hypercube(M,iters,backend=None):
+    if _sparse(M, backend):
+        FINAL = sp.csr_matrix(M)
+        for i in range(iters):
+            I     = sp.identity(FINAL.shape[0], format="csr")
+            FINAL = sp.bmat([[FINAL,I],[I,FINAL]], format="csr")
+        return FINAL
+    if sp.issparse(M):
+        M = M.toarray()
     for i in range(iters):
         if (i > 0):
             M=FINAL
@@ -21,7 +44,16 @@ def Hypercube(M,iters):
     
     return FINAL
 
-def Simplex(M,iters):
+def Simplex(M,iters,backend=None):
+    if _sparse(M, backend):
+        FINAL = sp.csr_matrix(M)
+        for i in range(iters):
+            m     = FINAL.shape[0]
+            RIGHT = sp.csr_matrix(np.ones((m,1)))
+            FINAL = sp.bmat([[FINAL,RIGHT],[RIGHT.T,None]], format="csr")
+        return FINAL
+    if sp.issparse(M):
+        M = M.toarray()
     for i in range(iters):
         if (i > 0):
             M=FINAL
@@ -33,79 +65,443 @@ def Simplex(M,iters):
         FINAL  = np.concatenate((temp,BOTTOM),axis=0)
     
     return FINAL
-def MakeGrid(n):
+def MakeGrid(n,backend="dense"):
+   if _sparse(None, backend):
+       offdi = MakeLine(n,backend)
+       I = sp.identity(n, format="csr")
+       return (sp.kron(offdi,I) + sp.kron(I,offdi)).tocsr()
    N = np.zeros([n,1])
    N[1]=1    
+   import scipy.linalg as la
    offdi = la.toeplitz(N)
    I = np.eye(n)
    A = np.kron(offdi,I) + np.kron(I,offdi)
    return A
-def MakeLine(n):
+def MakeLine(n,backend="dense"):
+   if _sparse(None, backend):
+       return sp.diags([np.ones(n-1),np.ones(n-1)],[-1,1],format="csr")
    N = np.zeros([n,1])
    N[1]=1    
+   import scipy.linalg as la
    offdi = la.toeplitz(N)
    return offdi
 
+class ImplicitFigure:
+    """
+    A figure built from a point by Hypercube and Simplex steps, whose
+    neighbours are generated on demand instead of storing an adjacency matrix.
+    Vertices are numbered exactly as in the matrices Hypercube/Simplex build.
+    """
+
+    def __init__(self, ops=()):
+        self.ops = list(ops)
+        self.sizes = [1]
+        for op in self.ops:
+            if op == "H":
+                self.sizes.append(2*self.sizes[-1])
+            elif op == "S":
+                self.sizes.append(self.sizes[-1] + 1)
+            else:
+                raise ValueError(f"operations must be 'H' or 'S', got {op!r}")
+
+    def Hypercube(self, iters):
+        return ImplicitFigure(self.ops + ["H"]*iters)
+
+    def Simplex(self, iters):
+        return ImplicitFigure(self.ops + ["S"]*iters)
+
+    @property
+    def shape(self):
+        return (self.sizes[-1], self.sizes[-1])
+
+    def __len__(self):
+        return self.sizes[-1]
+
+    def neighbors(self, v):
+        if not 0 <= v < self.sizes[-1]:
+            raise IndexError(f"vertex {v} out of range for {self.sizes[-1]} vertices")
+        return self._neighbors(v, len(self.ops))
+
+    def _neighbors(self, v, k):
+        # Unwind the operations from the last one back to the point.
+        extra = []
+        offset = 0
+        while k > 0:
+            m = self.sizes[k-1]
+            if self.ops[k-1] == "H":
+                if v < m:
+                    extra.append(offset + v + m)
+                else:
+                    extra.append(offset + v - m)
+                    offset += m
+                    v -= m
+            elif v == m:
+                return extra + [offset + u for u in range(m)]
+            else:
+                extra.append(offset + m)
+            k -= 1
+        return extra
+
+    def degree(self, v):
+        return len(self.neighbors(v))
+
+    def tosparse(self):
+        FINAL = sp.csr_matrix((1,1))
+        for op in self.ops:
+            FINAL = Hypercube(FINAL,1) if op == "H" else Simplex(FINAL,1)
+        return FINAL
+
 def Normer(M):
+    if sp.issparse(M):
+        norms = np.asarray(abs(M).sum(axis=0)).ravel()
+        return (M @ sp.diags(1/norms)).tocsr()
     norms = np.linalg.norm(M,ord=1, axis=0)
     FINAL = M/norms
     return FINAL
 
-def CalculateAbsorptionTimes(M,w):
-    C=Normer(M)
-    c  = C.shape[0]
-    p = [*range(0, c, 1)]
-#    w = c-1  #this controls which vertex is absorbing
-    p[c-1] = w
-    p[w] = c-1
-    C[:,:] = C[p,:]
-    C[:,:] = C[:,p]
-    ONES = np.array(np.ones((c-1,1)))
-    D=C[0:c-1,0:c-1]
-    I = np.identity(c-1)
-    X1=np.linalg.inv(I-D)
-    AbsorptionTimes = np.dot(X1,ONES)
-    return AbsorptionTimes
+class AbsorptionSolver:
+    """
+    Expected absorption times of the walk Normer(M) for any absorbing vertex w,
+    by solving (I-D)t = 1 instead of inverting I-D.
+    method="lu" factorizes once with sparse LU and answers every later w
+    through a rank-2 Woodbury update of that factorization; "cg" runs
+    conjugate gradients on the grounded Laplacian (symmetric M only);
+    "gmres" runs GMRES on the system itself.
+    """
+
+    def __init__(self, M, method="lu", rtol=1e-10):
+        if method not in ("lu", "cg", "gmres"):
+            raise ValueError(f"method must be 'lu', 'cg' or 'gmres', got {method!r}")
+        M = sp.csc_matrix(M, dtype=float)
+        self.M = M
+        self.method = method
+        self.rtol = rtol
+        self.n = M.shape[0]
+        self.norms = np.asarray(abs(M).sum(axis=0)).ravel()
+        C = Normer(M)
+        self.A = (sp.identity(self.n, format="csr") - C).tocsr()
+        if method == "cg" and abs(M - M.T).max() > 0:
+            raise ValueError("method='cg' needs a symmetric adjacency matrix")
+        self._lu = None
+
+    def _factorize(self):
+        # Base system: vertex w0 = n-1 absorbing, i.e. row w0 of A replaced by e_w0.
+        w0 = self.n - 1
+        keep = np.ones(self.n)
+        keep[w0] = 0
+        A0 = sp.diags(keep) @ self.A + sp.diags(1 - keep)
+        import scipy.sparse.linalg as sla
+        self._lu = sla.splu(A0.tocsc())
+        e = np.zeros(self.n)
+        e[w0] = 1
+        self._z0 = self._lu.solve(e)
+        self._v0 = self.A[w0,:].toarray().ravel() - e
+
+    def vertex_times(self, w):
+        """
+        Absorption time from every vertex, in vertex order, with 0 at w.
+        """
+        if not 0 <= w < self.n:
+            raise IndexError(f"vertex {w} out of range for {self.n} vertices")
+        b = np.ones(self.n)
+        b[w] = 0
+        if self.method == "lu":
+            return self._solve_lu(w, b)
+        keep = np.arange(self.n) != w
+        x = np.zeros(self.n)
+        import scipy.sparse.linalg as sla
+        if self.method == "cg":
+            # With t = Deg s the system becomes (Deg - M)s = 1 on the kept vertices.
+            L = (sp.diags(self.norms) - self.M).tocsr()[keep][:,keep]
+            pre = sp.diags(1/L.diagonal())
+            s, info = sla.cg(L, b[keep], rtol=self.rtol, M=pre)
+            x[keep] = self.norms[keep]*s
+        else:
+            s, info = sla.gmres(self.A[keep][:,keep], b[keep], rtol=self.rtol)
+            x[keep] = s
+        if info != 0:
+            raise np.linalg.LinAlgError(f"{self.method} did not converge (info={info})")
+        return x
+
+    def _solve_lu(self, w, b):
+        if self._lu is None:
+            self._factorize()
+        y = self._lu.solve(b)
+        w0 = self.n - 1
+        if w == w0:
+            return y
+        # A_w = A_w0 + e_w v^T + e_w0 v0^T, so Woodbury needs two more solves' worth.
+        e = np.zeros(self.n)
+        e[w] = 1
+        v = e - self.A[w,:].toarray().ravel()
+        Z = np.column_stack((self._lu.solve(e), self._z0))
+        V = np.vstack((v, self._v0))
+        x = y - Z @ np.linalg.solve(np.identity(2) + V @ Z, V @ y)
+        # The update leaves rounding error in the absorbing entry.
+        x[w] = 0
+        return x
+
+    def __call__(self, w):
+        """
+        Same layout as CalculateAbsorptionTimes: vertices w and c-1 swapped,
+        the absorbing vertex dropped, as a (c-1, 1) column.
+        """
+        x = self.vertex_times(w)
+        p = np.arange(self.n)
+        p[[w, self.n - 1]] = p[[self.n - 1, w]]
+        return x[p[:self.n - 1]].reshape(-1, 1)
+
+def CalculateAbsorptionTimes(M,w,method="lu"):
+    return AbsorptionSolver(M,method)(w)
+
+# Largest fraction of the vertices the quotient may keep before
+# LumpedAbsorption solves on the whole figure instead; quotients of up to
+# LUMP_MIN classes are always solved, being cheaper than building the figure.
+LUMP_LIMIT = 0.5
+LUMP_MIN = 1024
+
+class LumpedAbsorption:
+    """
+    Absorption times for the figure built by a sequence of Hypercube ("H")
+    and Simplex ("S") steps from a point, solved on the quotient of the walk
+    by the symmetries that fix the absorbing vertex w.
+    Within a run of H steps the copies can be swapped and the steps permuted,
+    and within a run of S steps the apexes can be permuted. A vertex's orbit
+    is therefore fixed by the step that created it (the point, w's step, or
+    the run of S it is an apex of) and, for every run of H after w was
+    created, its Hamming distance from w within that run.
+    When the quotient would keep more than LUMP_MIN classes and more than
+    LUMP_LIMIT of the vertices (e.g. alternating H and S), lumped is False
+    and the times come from an AbsorptionSolver on the whole figure instead,
+    by conjugate gradients since apexes make sparse LU fill in badly;
+    classes, Q and class_times are then None.
+    """
+
+    def __init__(self, ops, w=0):
+        fig = ops if isinstance(ops, ImplicitFigure) else ImplicitFigure(ops)
+        self.ops = fig.ops
+        self.sizes = fig.sizes
+        self.n = fig.sizes[-1]
+        if not 0 <= w < self.n:
+            raise IndexError(f"vertex {w} out of range for {self.n} vertices")
+        self.w = w
+        L = len(self.ops)
+
+        # Runs of equal operations, as [op, first step, last step] with steps 1..L.
+        self.runs = []
+        for j, op in enumerate(self.ops, start=1):
+            if self.runs and self.runs[-1][0] == op:
+                self.runs[-1][2] = j
+            else:
+                self.runs.append([op, j, j])
+
+        self.kw, self.wbits = self._decompose(w)
+        # Runs of H in which w has coordinates carry a distance in the label.
+        self.hw = [R for R in self.runs if R[0] == "H" and R[1] > self.kw]
+
+        # Origins: w's step, the point, and each run of S with an apex other than w.
+        self.origins = [("w", self.kw)]
+        if self.kw != 0:
+            self.origins.append(("p", 0))
+        for T, R in enumerate(self.runs):
+            if R[0] == "S":
+                steps = [j for j in range(R[1], R[2] + 1) if j != self.kw]
+                if steps:
+                    self.origins.append((("s", T), steps[0]))
+        self.origin_index = {tag: i for i, (tag, _) in enumerate(self.origins)}
+
+        K = sum(math.prod(R[2] - R[1] + 2 for R in self.hw if R[1] > k) for _, k in self.origins)
+        self.lumped = K <= max(LUMP_MIN, LUMP_LIMIT*self.n)
+        if not self.lumped:
+            self.classes = self.class_index = self.Q = self.class_times = None
+            self._times = AbsorptionSolver(fig.tosparse(), "cg").vertex_times(w)
+            return
+
+        self.classes = []
+        for o, (tag, k) in enumerate(self.origins):
+            ranges = [range(R[2] - R[1] + 2) if R[1] > k else range(1) for R in self.hw]
+            for d in itertools.product(*ranges):
+                self.classes.append((o, d))
+        self.class_index = {label: i for i, label in enumerate(self.classes)}
+
+        rows, cols, vals = [], [], []
+        for X, label in enumerate(self.classes):
+            for Y, weight in self._transitions(label).items():
+                rows.append(X)
+                cols.append(self.class_index[Y])
+                vals.append(weight)
+        rows, cols, vals = np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64), np.array(vals)
+        self.Q = sp.csr_matrix((vals, (rows, cols)), shape=(K, K))
+        # I - Q with the absorbing class's row replaced by e_wi, and right-hand side 0 there.
+        wi = self.class_index[(0, (0,)*len(self.hw))]
+        moving = rows != wi
+        b = np.ones(K)
+        b[wi] = 0
+        if K <= LUMP_MIN:
+            # Small quotients: a dense solve is cheaper than sparse setup.
+            A = np.identity(K)
+            A[rows[moving], cols[moving]] -= vals[moving]
+            self.class_times = np.linalg.solve(A, b)
+        else:
+            A = sp.csc_matrix((np.concatenate((np.ones(K), -vals[moving])),
+                               (np.concatenate((np.arange(K), rows[moving])),
+                                np.concatenate((np.arange(K), cols[moving])))), shape=(K, K))
+            import scipy.sparse.linalg as sla
+            self.class_times = sla.spsolve(A, b)
+
+    def _decompose(self, v):
+        """
+        The step k that created v (0 for the point) and v's copy bit for
+        every H step after k.
+        """
+        bits = {}
+        k = len(self.ops)
+        while k > 0:
+            m = self.sizes[k-1]
+            if self.ops[k-1] == "H":
+                bits[k] = int(v >= m)
+                v -= m*bits[k]
+            elif v == m:
+                break
+            k -= 1
+        return k, bits
+
+    def _degree(self, k):
+        return (self.sizes[k-1] if k > 0 else 0) + len(self.ops) - k
+
+    def _tag(self, k):
+        if k == self.kw:
+            return "w"
+        if k == 0:
+            return "p"
+        for T, R in enumerate(self.runs):
+            if R[1] <= k <= R[2]:
+                return ("s", T)
+
+    def _restrict(self, d, k):
+        # Vertices created at step k have no coordinates in earlier runs.
+        return tuple(x if R[1] > k else 0 for x, R in zip(d, self.hw))
+
+    def _transitions(self, label):
+        """
+        Sum of Normer(M)[x, y] over each class of neighbours y, for a vertex x
+        of the given class.
+        """
+        o, d = label
+        k = self.origins[o][1]
+        out = collections.defaultdict(float)
+        hw_pos = {R[1]: i for i, R in enumerate(self.hw)}
+        for T, (op, first, last) in enumerate(self.runs):
+            if last <= k:
+                continue
+            r = last - first + 1
+            if op == "H":
+                # Neighbours across the copies of each step of the run.
+                deg = self._degree(k)
+                if first in hw_pos:
+                    i = hw_pos[first]
+                    if d[i] > 0:
+                        out[(o, d[:i] + (d[i] - 1,) + d[i+1:])] += d[i]/deg
+                    if r - d[i] > 0:
+                        out[(o, d[:i] + (d[i] + 1,) + d[i+1:])] += (r - d[i])/deg
+                else:
+                    out[label] += r/deg
+            else:
+                # The apexes added after x was created.
+                steps = [j for j in range(first, last + 1) if j > k]
+                for j in steps:
+                    if j == self.kw:
+                        out[(0, self._restrict(d, j))] += 1/self._degree(j)
+                others = len(steps) - (self.kw in steps)
+                if others:
+                    out[(self.origin_index[("s", T)], self._restrict(d, first))] += others/self._degree(first)
+        if k > 0:
+            # x is an apex: joined to every vertex that existed before it.
+            groups = collections.Counter(self._tag(j) for j in [0] + [
+                j for R in self.runs if R[0] == "S" for j in range(R[1], min(R[2], k - 1) + 1)])
+            for tag, count in groups.items():
+                k2 = self.kw if tag == "w" else 0 if tag == "p" else self.origins[self.origin_index[tag]][1]
+                deg = self._degree(k2)
+                between = [R for R in self.runs if R[0] == "H" and k2 < R[1] < k]
+                free = sum(R[2] - R[1] + 1 for R in between if R[1] not in hw_pos)
+                summed = [R for R in between if R[1] in hw_pos]
+                base = tuple(x if R[1] > k else 0 for x, R in zip(d, self.hw))
+                for e in itertools.product(*(range(R[2] - R[1] + 2) for R in summed)):
+                    mult = count*2**free
+                    d2 = list(base)
+                    for R, x in zip(summed, e):
+                        mult *= math.comb(R[2] - R[1] + 1, x)
+                        d2[hw_pos[R[1]]] = x
+                    out[(self.origin_index[tag], tuple(d2))] += mult/deg
+        return out
+
+    def label(self, v):
+        """
+        The orbit class of vertex v.
+        """
+        k, bits = self._decompose(v)
+        d = tuple(sum(bits.get(j, 0) != self.wbits[j] for j in range(R[1], R[2] + 1))
+                  if R[1] > k else 0 for R in self.hw)
+        return (self.origin_index[self._tag(k)], d)
+
+    def time_of(self, v):
+        if not self.lumped:
+            return self._times[v]
+        return self.class_times[self.class_index[self.label(v)]]
+
+    def vertex_times(self):
+        """
+        Absorption time from every vertex, in vertex order, with 0 at w.
+        """
+        if not self.lumped:
+            return self._times.copy()
+        strides = np.cumprod([1] + [R[2] - R[1] + 2 for R in self.hw])
+        code_of = {}
+        for i, (o, d) in enumerate(self.classes):
+            code_of[o*strides[-1] + sum(x*s for x, s in zip(d, strides))] = i
+        hw_pos = {R[1]: i for i, R in enumerate(self.hw)}
+        code = np.array([self.origin_index[self._tag(0)]*strides[-1]], dtype=np.int64)
+        for j, op in enumerate(self.ops, start=1):
+            if op == "H":
+                R = next(i for i, R in enumerate(self.runs) if R[1] <= j <= R[2])
+                first = self.runs[R][1]
+                step = strides[hw_pos[first]] if first in hw_pos else 0
+                wb = self.wbits.get(j, 0)
+                code = np.concatenate((code + step*wb, code + step*(1 - wb)))
+            else:
+                apex = self.origin_index[self._tag(j)]*strides[-1]
+                code = np.append(code, apex)
+        lookup = np.zeros(int(strides[-1])*len(self.origins), dtype=np.int64)
+        for c, i in code_of.items():
+            lookup[c] = i
+        return self.class_times[lookup[code]]
+
+    def __call__(self):
+        """
+        Same layout as CalculateAbsorptionTimes(M, w).
+        """
+        x = self.vertex_times()
+        p = np.arange(self.n)
+        p[[self.w, self.n - 1]] = p[[self.n - 1, self.w]]
+        return x[p[:self.n - 1]].reshape(-1, 1)
     
 
-Point    = np.array([[0]])
-Line     = Hypercube(Point,1)
-#Line    = Simplex(Point,1)
-Square   = Hypercube(Line,1)
-Triangle = Simplex(Line,1)
-SqPyr    = Simplex(Square,1)
-TriPrism = Hypercube(Triangle,1)
-Cube     = Hypercube(Square,1)
-Tetrahed = Simplex(Triangle,1)
-FourCell = Simplex(Tetrahed,1)
-FourCube= Hypercube(Cube,1)
-
-#plt.matshow(Hypercube(Point,6))
-#plt.show()
-
-
-A= MakeGrid(3)
-#plt.matshow(A)
-#plt.show()
-B=nx.DiGraph(A)
-nx.draw(B)
-CalculateAbsorptionTimes(A,0)
-
-a1 = max(max(CalculateAbsorptionTimes(Line,0)))
-a2 = max(max(CalculateAbsorptionTimes(Square,0)))
-a3 = max(max(CalculateAbsorptionTimes(Triangle,0)))
-a4 = max(max(CalculateAbsorptionTimes(SqPyr,0)))
-a5 = max(max(CalculateAbsorptionTimes(TriPrism,0)))
-a6 = max(max(CalculateAbsorptionTimes(Cube,0)))
-a7 = max(max(CalculateAbsorptionTimes(Tetrahed,0)))
-a8 = max(max(CalculateAbsorptionTimes(FourCell,0)))
-a9 = max(max(CalculateAbsorptionTimes(FourCube,0)))
-
-
-MaxAbs=[a1,a2,a3,a4,a5,a6,a7,a8,a9]
-
-print(MaxAbs)
-
-#Shapes=[Line,Square,Triangle,SqPyr,TriPrism,Cube,Tetrahed,FourCell,FourCube]
-#for shape in Shapes:
-#    print(CalculateAbsorptionTimes(shape,0))
+def main():
+    #import matplotlib.pyplot as plt
+    A= MakeGrid(3)
+    #plt.matshow(A)
+    #plt.show()
+    import networkx as nx
+    B=nx.DiGraph(A)
+    nx.draw(B)
+    CalculateAbsorptionTimes(A,0)
+
+    # Line, Square, Triangle, SqPyr, TriPrism, Cube, Tetrahed, FourCell and
+    # FourCube as operation strings.
+    Ops   = ["H", "HH", "HS", "HHS", "HSH", "HHH", "HSS", "HSSS", "HHHH"]
+    MaxAbs = [float(LumpedAbsorption(ops, 0).vertex_times().max()) for ops in Ops]
+
+    print(MaxAbs)
+
+if __name__ == "__main__":
+    main()
@@ -14,38 +14,290 @@ How many 3-dimensional components exist in the figure resulting from the operati
 6373
 """
 
-import sympy as sp
-x, y = sp.symbols('x y')
+import numpy as np
+
 point = 1
 
+# sympy is only needed for the symbolic H and S below and is imported on
+# first use, so the numeric engine can be imported without it.
+_symbols = None
+
+def symbols():
+    """
+    The sympy symbols (x, y) used by H and S.
+    """
+    global _symbols
+    if _symbols is None:
+        import sympy as sp
+        _symbols = sp.symbols('x y')
+    return _symbols
+
+def __getattr__(name):
+    # Keeps "from IterativeOperations import x, y" working without importing
+    # sympy until they are asked for.
+    if name in ("x", "y"):
+        return symbols()["xy".index(name)]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # When applied to an expression w, it simulates the hypercube operation by multiplying w by (y + 2).
 # This corresponds to "doubling" the figure along a new orthogonal axis. The multiplication by 2 represents the copy in the new dimension,
 # the multiplication by y represents the structure in between the 2 copies.
 def H(w):
+    x, y = symbols()
     return (y + 2) * w
 # When applied to an expression w, it simulates the simplex operation by transforming w into (x + 1)*w + 1.
 # The added "+1" corresponds to adding a new vertex, and (x+1) scales the existing structure. The multiplication by 1 represents the original unchanged copy,
 # the multiplication by x represents the structure in between the new vertex and the original structure.
 def S(w):
+    x, y = symbols()
     return (x + 1) * w + 1
+
+# Numeric engine: the polynomial is a dense coefficient array C with C[i, j]
+# the coefficient of x**i * y**j, so H is a shift along y plus a doubling,
+# S is a shift along x plus the original plus 1, and the number of
+# k-dimensional components is the sum of the anti-diagonal i + j = k.
+# Coefficients are int64 until they could overflow, then Python ints.
+
+INT64_LIMIT = 2**62
+
+def sequence_to_ops(sequence):
+    """
+    Expands a run-length sequence (a_1, a_2, ...) into the operations in the
+    order they are applied: a_1 H's, then a_2 S's, and so on.
+    """
+    return "".join(("H" if i % 2 == 0 else "S")*a for i, a in enumerate(sequence))
+
+def _ops(ops):
+    if isinstance(ops, str):
+        return ops
+    return sequence_to_ops(ops)
+
+def extend(C, ops, total=None):
+    """
+    Applies further operations to an existing coefficient array and returns
+    the new array and its total (the polynomial at x = y = 1, which bounds
+    every entry). C itself is left unchanged.
+    """
+    ops = _ops(ops)
+    if total is None:
+        total = int(C.sum())
+    s, h = C.shape[0] - 1, C.shape[1] - 1
+    nS, nH = ops.count("S"), ops.count("H")
+    out = np.zeros((s + nS + 1, h + nH + 1), dtype=C.dtype)
+    out[:s+1, :h+1] = C
+    C = out
+    for op in ops:
+        if op == "H":
+            total *= 3
+        elif op == "S":
+            total = 2*total + 1
+        else:
+            raise ValueError(f"operations must be 'H' or 'S', got {op!r}")
+        if C.dtype != object and total >= INT64_LIMIT:
+            C = C.astype(object)
+        if op == "H":
+            old = C[:s+1, :h+1].copy()
+            C[:s+1, :h+1] *= 2
+            C[:s+1, 1:h+2] += old
+            h += 1
+        else:
+            old = C[:s+1, :h+1].copy()
+            C[1:s+2, :h+1] += old
+            C[0, 0] += 1
+            s += 1
+    return C, total
+
+def coefficients(ops):
+    """
+    Coefficient array of the polynomial for a string of "H"/"S" operations
+    (or a run-length sequence), starting from point = 1.
+    """
+    return extend(np.ones((1, 1), dtype=np.int64), ops, 1)[0]
+
+def face_counts(C):
+    """
+    f-vector of a coefficient array: entry k is the number of k-dimensional
+    components, the sum of the anti-diagonal i + j = k.
+    """
+    rows, cols = C.shape
+    flipped = np.fliplr(C)
+    return [flipped.diagonal(cols - 1 - k).sum() for k in range(rows + cols - 1)]
+
+def count_components(ops, k):
+    """
+    Number of k-dimensional components of the figure built by ops.
+    """
+    counts = face_counts(coefficients(ops))
+    return int(counts[k]) if k < len(counts) else 0
+
+class FaceCountTrie:
+    """
+    Prefix trie of coefficient arrays keyed by run-length prefixes, so a batch
+    of related sequences only computes each shared prefix once. A new run is
+    started from the longest cached run of the same operation where possible,
+    e.g. (2, 1, 4, 6) extends the node for (2, 1, 4, 5) by one S.
+    """
+
+    def __init__(self):
+        self.root = {"C": np.ones((1, 1), dtype=np.int64), "total": 1, "children": {}}
+
+    def node(self, sequence):
+        node = self.root
+        for i, a in enumerate(sequence):
+            children = node["children"]
+            if a not in children:
+                op = "H" if i % 2 == 0 else "S"
+                shorter = [b for b in children if b < a]
+                start = children[max(shorter)] if shorter else node
+                done = max(shorter) if shorter else 0
+                C, total = extend(start["C"], op*(a - done), start["total"])
+                children[a] = {"C": C, "total": total, "children": {}}
+            node = children[a]
+        return node
+
+    def coefficients(self, sequence):
+        return self.node(sequence)["C"]
+
+    def f_vector(self, sequence):
+        return [int(c) for c in face_counts(self.coefficients(sequence))]
+
+    def f_vectors(self, sequences):
+        return [self.f_vector(sequence) for sequence in sequences]
+
+    def clear(self):
+        self.root["children"] = {}
+
+# Run-length evaluation. The f-vector only depends on P(t, t), so H and S
+# act on a single polynomial F(t): a run of k H's multiplies it by
+# (t + 2)**k, and a run of k S's maps it to
+# (t + 1)**k * F + ((t + 1)**k - 1)/t. Each run is therefore one product
+# with a binomial row, so the number of Python-level steps scales with the
+# number of runs. Products are numpy convolutions while the counts fit in
+# int64 (or modulo a modulus below 2**31), and otherwise big-integer
+# products with F packed into one integer (Kronecker substitution).
+
+def _pack(coeffs, nbytes):
+    return int.from_bytes(b"".join(int(c).to_bytes(nbytes, "little") for c in coeffs), "little")
+
+def _unpack(N, nbytes, length):
+    raw = N.to_bytes(nbytes*length, "little")
+    return [int.from_bytes(raw[i*nbytes:(i + 1)*nbytes], "little") for i in range(length)]
+
+def _nbytes(bound):
+    return bound.bit_length()//8 + 1
+
+def _binomial_row(k, c):
+    """
+    Coefficients of (t + c)**k, lowest degree first.
+    """
+    nbytes = _nbytes((c + 1)**k)
+    return _unpack(pow((1 << 8*nbytes) + c, k), nbytes, k + 1)
+
+def _convolve_mod(a, b, modulus):
+    # b is split into 16-bit limbs and a into chunks of 2**16 terms, so every
+    # partial sum of products of residues below 2**31 stays below 2**63.
+    lo, hi = b & 0xFFFF, b >> 16
+    out = np.zeros(len(a) + len(b) - 1, dtype=np.int64)
+    for start in range(0, len(a), 1 << 16):
+        chunk = a[start:start + (1 << 16)]
+        part = (np.convolve(chunk, lo) % modulus + ((np.convolve(chunk, hi) % modulus) << 16)) % modulus
+        out[start:start + len(part)] = (out[start:start + len(part)] + part) % modulus
+    return out
+
+def _binomial_row_mod(k, c, modulus):
+    """
+    Coefficients of (t + c)**k modulo a modulus below 2**31, by repeated squaring.
+    """
+    row = np.ones(1, dtype=np.int64)
+    base = np.array([c % modulus, 1 % modulus], dtype=np.int64)
+    while k:
+        if k & 1:
+            row = _convolve_mod(row, base, modulus)
+        k >>= 1
+        if k:
+            base = _convolve_mod(base, base, modulus)
+    return row
+
+def f_vector_runs(sequence, modulus=None):
+    """
+    f-vector of a run-length sequence, applying each run at once through its
+    closed-form binomial power. With a modulus every count is reduced modulo it.
+    """
+    if modulus is not None and modulus < 1:
+        raise ValueError("modulus must be a positive integer")
+    small = modulus is not None and modulus < 2**31
+    F = np.array([1 if modulus is None else 1 % modulus], dtype=np.int64)
+    total = 1  # F(1), which bounds every coefficient in exact mode
+    for i, k in enumerate(sequence):
+        if k < 0:
+            raise ValueError("run lengths must be non-negative")
+        if k == 0:
+            continue
+        c = 2 if i % 2 == 0 else 1
+        total = total*3**k if c == 2 else (total + 1)*2**k - 1
+        if small or (modulus is None and total < INT64_LIMIT):
+            if small:
+                row = _binomial_row_mod(k, c, modulus)
+                F = _convolve_mod(F, row, modulus)
+            else:
+                row = np.array(_binomial_row(k, c), dtype=np.int64)
+                F = np.convolve(F, row)
+            if c == 1:
+                # ((t + 1)**k - 1)/t drops the constant 1 and shifts down one place.
+                F[:k] += row[1:]
+                if small:
+                    F[:k] %= modulus
+            continue
+        if modulus is None:
+            row = _binomial_row(k, c)
+            nbytes = _nbytes(total)
+        else:
+            row = [b % modulus for b in _binomial_row(k, c)]
+            nbytes = _nbytes(min(len(F), k + 1)*(modulus - 1)**2 + modulus)
+        power = _pack(row, nbytes)
+        N = _pack(F, nbytes)*power
+        if c == 1:
+            N += _pack(row[1:], nbytes)
+        F = _unpack(N, nbytes, len(F) + k)
+        if modulus is not None:
+            F = [f % modulus for f in F]
+    return [int(f) for f in F]
+
+def count_components_runs(sequence, k, modulus=None):
+    F = f_vector_runs(sequence, modulus)
+    return F[k] if k < len(F) else 0
+
+def f_vectors(sequences, trie=None):
+    """
+    Full f-vector of every run-length sequence in a batch.
+    """
+    if trie is None:
+        trie = FaceCountTrie()
+    return trie.f_vectors(sequences)
     
-expr = sp.expand(S(S(S(S(S  (H(H(H(H  (S  (H(H(point))))))))))))) # 2, 1, 4, 5
-print(expr)
-poly = sp.Poly(expr, x, y)
-monomials = poly.monoms()
-coefficients = poly.coeffs()
-
-sum_3d = 0
-sum_3d_coefficients =0
-
-# Iterate through the monomials and coefficients
-for i, monomial in enumerate(monomials):
-    # Check if the monomial is 3-dimensional (degree 3)
-    if sum(monomial) == 3:
-        # Add the term to the sum
-        sum_3d += coefficients[i] * sp.prod([x**monomial[0], y**monomial[1]])
-        # Add the coefficient to the sum
-        sum_3d_coefficients += coefficients[i]
-print("Sum of coefficients of 3-dimensional components:", sum_3d_coefficients)
-print("Sum of 3-dimensional components:", sum_3d)
+def main():
+    import sympy as sp
+    x, y = symbols()
+    expr = sp.expand(S(S(S(S(S  (H(H(H(H  (S  (H(H(point))))))))))))) # 2, 1, 4, 5
+    print(expr)
+    poly = sp.Poly(expr, x, y)
+    monomials = poly.monoms()
+    coeffs = poly.coeffs()
+
+    sum_3d = 0
+    sum_3d_coefficients =0
+
+    # Iterate through the monomials and coefficients
+    for i, monomial in enumerate(monomials):
+        # Check if the monomial is 3-dimensional (degree 3)
+        if sum(monomial) == 3:
+            # Add the term to the sum
+            sum_3d += coeffs[i] * sp.prod([x**monomial[0], y**monomial[1]])
+            # Add the coefficient to the sum
+            sum_3d_coefficients += coeffs[i]
+    print("Sum of coefficients of 3-dimensional components:", sum_3d_coefficients)
+    print("Sum of 3-dimensional components:", sum_3d)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Daniel Ketterer
+
+Parameter sweeps of absorption times over the figures built from a point by
+Hypercube ("H") and Simplex ("S") steps, generalizing the MaxAbs list of
+HypercubeSimplexConstructor. Every figure up to a size bound is enumerated,
+its absorption statistics are computed across a process pool, and each
+result is stored in a content-addressed cache on disk, keyed by the
+operation string and the absorbing vertex, so reruns and extended sweeps
+only compute what is new.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from HypercubeSimplexConstructor import AbsorptionSolver, ImplicitFigure, LumpedAbsorption
+
+# Bump when the statistics or their computation change, so old cache entries
+# are no longer found.
+STATS_VERSION = 1
+
+METHODS = ("lumped", "lu")
+
+# -------------------------
+# Figures
+# -------------------------
+
+def normalize_ops(ops):
+    """
+    The operation string used as a key. H and S are the same step on a
+    point (both give a segment), so a leading S is written as H.
+    """
+    ops = "".join(ops)
+    if ops.strip("HS"):
+        raise ValueError(f"operations must be 'H' or 'S', got {ops!r}")
+    return "H" + ops[1:] if ops[:1] == "S" else ops
+
+def enumerate_figures(max_vertices, max_ops=None):
+    """
+    Every normalized operation string whose figure has at most max_vertices
+    vertices (and at most max_ops steps), shortest first.
+    """
+    found = []
+    frontier = [("", 1)]
+    while frontier:
+        following = []
+        for ops, n in frontier:
+            found.append(ops)
+            if max_ops is not None and len(ops) >= max_ops:
+                continue
+            if 2*n <= max_vertices:
+                following.append((ops + "H", 2*n))
+            if ops and n + 1 <= max_vertices:
+                following.append((ops + "S", n + 1))
+        frontier = following
+    return found
+
+# -------------------------
+# Cache
+# -------------------------
+
+def cache_key(ops, w):
+    """
+    Hash of the normalized operations, the absorbing vertex and STATS_VERSION.
+    The solver method is not part of the key: every method computes the same
+    times, so an entry from one serves the others.
+    """
+    text = json.dumps({"ops": normalize_ops(ops), "w": int(w), "version": STATS_VERSION}, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+class ResultCache:
+    """
+    Results stored as one JSON file per key under root/<first 2 hex>/<key>.json.
+    Writes go to a temporary file that is then renamed, so an interrupted or
+    concurrent run never leaves a partial entry.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key + ".json")
+
+    def get(self, ops, w):
+        try:
+            with open(self.path(cache_key(ops, w))) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def __contains__(self, item):
+        return os.path.exists(self.path(cache_key(*item)))
+
+    def put(self, ops, w, stats):
+        path = self.path(cache_key(ops, w))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(stats, f)
+            # mkstemp creates the file readable by its owner only; give it the
+            # permissions open() would, so a shared cache stays readable.
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp, 0o666 & ~umask)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+# -------------------------
+# Statistics
+# -------------------------
+
+def _summary(ops, w, times, method, seconds):
+    others = np.delete(times, w)
+    return {
+        "ops": ops,
+        "w": int(w),
+        "vertices": int(times.shape[0]),
+        "max_time": float(times.max()),
+        "argmax": int(times.argmax()),
+        "mean_time": float(others.mean()) if others.size else 0.0,
+        "method": method,
+        "seconds": seconds,
+    }
+
+def absorption_stats(ops, ws, method="lumped"):
+    """
+    Absorption statistics of the figure built by ops for each absorbing
+    vertex in ws: the largest expected time (MaxAbs) and the vertex it is
+    reached from, and the mean over the other starting vertices.
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}, got {method!r}")
+    ops = normalize_ops(ops)
+    fig = ImplicitFigure(ops)
+    solver = AbsorptionSolver(fig.tosparse()) if method == "lu" and len(fig) > 1 else None
+    out = []
+    for w in ws:
+        start = time.perf_counter()
+        if len(fig) == 1:
+            times = np.zeros(1)
+        elif method == "lu":
+            times = solver.vertex_times(w)
+        else:
+            times = LumpedAbsorption(fig, w).vertex_times()
+        out.append(_summary(ops, w, times, method, time.perf_counter() - start))
+    return out
+
+def _stats_task(task):
+    return absorption_stats(*task)
+
+def _absorbing(ops, absorbing):
+    n = len(ImplicitFigure(ops))
+    if absorbing == "origin":
+        return [0]
+    if absorbing == "all":
+        return list(range(n))
+    return [w for w in absorbing if w < n]
+
+def sweep(max_vertices, max_ops=None, absorbing="origin", cache_dir=".absorption_cache",
+          processes=None, method="lumped", log=None):
+    """
+    Absorption statistics of every figure with at most max_vertices vertices,
+    for the absorbing vertices selected by absorbing ("origin" for vertex 0,
+    "all", or a list of vertices). Cached entries are read back; missing
+    ones are computed, one task per figure, over a multiprocessing pool when
+    processes > 1, and written to the cache as they finish.
+    Returns (records, number computed).
+    """
+    cache = ResultCache(cache_dir)
+    records = {}
+    tasks = []
+    for ops in enumerate_figures(max_vertices, max_ops):
+        missing = []
+        for w in _absorbing(ops, absorbing):
+            entry = cache.get(ops, w)
+            if entry is None:
+                missing.append(w)
+            else:
+                records[(ops, w)] = entry
+        if missing:
+            tasks.append((ops, missing, method))
+    computed = 0
+
+    def store(results):
+        nonlocal computed
+        for stats in results:
+            cache.put(stats["ops"], stats["w"], stats)
+            records[(stats["ops"], stats["w"])] = stats
+            computed += 1
+            if log is not None:
+                log(stats)
+
+    if processes is None or processes <= 1:
+        for task in tasks:
+            store(_stats_task(task))
+    else:
+        # Largest figures first, so the pool is not left waiting on one at the end.
+        tasks.sort(key=lambda task: -len(ImplicitFigure(task[0])))
+        with multiprocessing.get_context().Pool(processes) as pool:
+            for results in pool.imap_unordered(_stats_task, tasks):
+                store(results)
+    return [records[key] for key in sorted(records, key=lambda key: (len(key[0]), key))], computed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep absorption times over H/S figures.")
+    parser.add_argument("--max-vertices", type=int, default=64)
+    parser.add_argument("--max-ops", type=int, default=None)
+    parser.add_argument("--absorbing", default="origin",
+                        help="'origin', 'all', or comma-separated vertices")
+    parser.add_argument("--method", choices=METHODS, default="lumped")
+    parser.add_argument("--cache", default=".absorption_cache", help="cache directory")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--output", help="write all records as JSON to this file")
+    args = parser.parse_args(argv)
+
+    absorbing = args.absorbing
+    if absorbing not in ("origin", "all"):
+        absorbing = [int(w) for w in absorbing.split(",")]
+    start = time.perf_counter()
+    records, computed = sweep(args.max_vertices, args.max_ops, absorbing, args.cache,
+                              args.processes, args.method)
+    for row in records:
+        print(f"{row['ops'] or '.':<24} w={row['w']:<6} n={row['vertices']:<8} "
+              f"max {row['max_time']:>14.6f} mean {row['mean_time']:>14.6f}")
+    print(f"{len(records)} results, {computed} computed, {len(records) - computed} cached "
+          f"in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(records, f, indent=1)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
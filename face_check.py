@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Daniel Ketterer
+
+Cross-checks the face-count polynomials of IterativeOperations against the
+figures HypercubeSimplexConstructor actually builds. The faces of a figure
+are enumerated as bitmask vertex sets from its sparse adjacency alone, by
+splitting off cone apexes and prism matchings found in the graph, then
+validated against the adjacency, counted by dimension and compared with the
+polynomial over a randomized sweep of operation sequences. The faces the
+H/S steps predict and, for small figures, the faces of the convex hull of an
+embedding are compared as well.
+"""
+import argparse
+import multiprocessing
+import sys
+
+import numpy as np
+import scipy.sparse as sp
+
+from HypercubeSimplexConstructor import Hypercube, Simplex
+from IterativeOperations import FaceCountTrie, f_vector_runs, sequence_to_ops
+
+TOL = 1e-9
+# Figures with at most this many vertices are also checked against Qhull.
+HULL_LIMIT = 64
+
+# -------------------------
+# Figures
+# -------------------------
+
+def adjacency(sequence):
+    """
+    Sparse adjacency of the figure for a run-length sequence, built from a
+    point with Hypercube and Simplex.
+    """
+    A = sp.csr_matrix(np.array([[0]]))
+    for i, a in enumerate(sequence):
+        if a:
+            A = (Hypercube if i % 2 == 0 else Simplex)(A, a, backend="sparse")
+    return A
+
+def embedding(ops):
+    """
+    Vertex coordinates for a string of "H"/"S" operations, numbered as
+    Hypercube/Simplex number them. Each step adds a coordinate: H places the
+    copy at 1 in it, S places the new vertex at 1 above the centroid.
+    """
+    X = np.zeros((1, 0))
+    for op in ops:
+        m = X.shape[0]
+        X = np.hstack([X, np.zeros((m, 1))])
+        if op == "H":
+            top = X.copy()
+            top[:, -1] = 1
+            X = np.vstack([X, top])
+        elif op == "S":
+            apex = X.mean(axis=0)
+            apex[-1] = 1
+            X = np.vstack([X, apex])
+        else:
+            raise ValueError(f"operations must be 'H' or 'S', got {op!r}")
+    return X
+
+# -------------------------
+# Faces
+# -------------------------
+# A vertex set is a Python int with bit v set for vertex v.
+
+def mask(on):
+    return int.from_bytes(np.packbits(on, bitorder="little").tobytes(), "little")
+
+def members(m):
+    out = []
+    while m:
+        low = m & -m
+        out.append(low.bit_length() - 1)
+        m ^= low
+    return out
+
+def _count(m):
+    return bin(m).count("1")
+
+def _distances(source, vs, nbrs):
+    """
+    BFS distance from source to every vertex of vs, within the subgraph vs induces.
+    """
+    dist = {source: 0}
+    reached = frontier = 1 << source
+    d = 0
+    while frontier:
+        d += 1
+        step = 0
+        for v in members(frontier):
+            step |= nbrs[v]
+        frontier = step & vs & ~reached
+        reached |= frontier
+        for v in members(frontier):
+            dist[v] = d
+    return dist
+
+def _apex(vs, nbrs):
+    """
+    A vertex of vs adjacent to all the others, or None.
+    """
+    for v in members(vs):
+        if nbrs[v] & vs | 1 << v == vs:
+            return v
+    return None
+
+def _prism(vs, nbrs):
+    """
+    Splits the subgraph vs induces as B x K2: returns the vertex set of B and
+    the matching from it onto the other copy, or None. The candidate copies
+    of each edge at the lowest vertex u are the vertices nearer u than its
+    neighbour and the rest; they are accepted when every vertex of B has
+    exactly one neighbour across, the matching is a bijection, and it maps
+    the edges of B exactly onto the edges of the other copy.
+    """
+    u = (vs & -vs).bit_length() - 1
+    for v in members(nbrs[u] & vs):
+        du = _distances(u, vs, nbrs)
+        dv = _distances(v, vs, nbrs)
+        bottom = 0
+        for x in du:
+            if du[x] < dv.get(x, du[x] + 1):
+                bottom |= 1 << x
+        top = vs & ~bottom
+        if 2*_count(bottom) != _count(vs):
+            continue
+        partner = {}
+        for x in members(bottom):
+            across = nbrs[x] & top
+            if not across or across & (across - 1):
+                break
+            partner[x] = across.bit_length() - 1
+        else:
+            if len(set(partner.values())) != len(partner):
+                continue
+            if all(_image(nbrs[x] & bottom, partner) == nbrs[partner[x]] & top for x in partner):
+                return bottom, partner
+    return None
+
+def _image(f, partner):
+    g = 0
+    for v in members(f):
+        g |= 1 << partner[v]
+    return g
+
+def graph_faces(nbrs, vs=None):
+    """
+    Every non-empty face of the figure with neighbour masks nbrs, as a dict
+    from vertex set to dimension, found from the graph alone. A vertex joined
+    to all others is a cone apex: the faces are those of the base, the apex,
+    and the cone over each base face. Otherwise the graph must be a prism
+    B x K2 (see _prism): the faces are those of B, their copies, and the
+    prism between each face and its copy. Raises ValueError when the graph
+    is neither.
+    """
+    if vs is None:
+        vs = (1 << len(nbrs)) - 1
+    if vs & (vs - 1) == 0:
+        return {vs: 0}
+    apex = _apex(vs, nbrs)
+    if apex is not None:
+        a = 1 << apex
+        dims = {a: 0}
+        for f, k in graph_faces(nbrs, vs & ~a).items():
+            dims[f] = k
+            dims[f | a] = k + 1
+        return dims
+    split = _prism(vs, nbrs)
+    if split is None:
+        raise ValueError(f"the subgraph on {members(vs)} is neither a cone nor a prism")
+    bottom, partner = split
+    dims = {}
+    for f, k in graph_faces(nbrs, bottom).items():
+        g = _image(f, partner)
+        dims[f] = k
+        dims[g] = k
+        dims[f | g] = k + 1
+    return dims
+
+def figure_faces(ops):
+    """
+    Every non-empty face of the figure built by a string of "H"/"S"
+    operations, as a dict from vertex set to dimension, numbered as
+    Hypercube/Simplex number the vertices. H turns each face G into G, its
+    copy and the prism between them; S keeps each face G and adds the cone
+    over G to the new apex, including the apex itself. Used as a cross-check
+    of graph_faces.
+    """
+    dims = {1: 0}
+    m = 1
+    for op in ops:
+        new = {}
+        if op == "H":
+            for f, k in dims.items():
+                g = f << m
+                new[f] = k
+                new[g] = k
+                new[f | g] = k + 1
+            m *= 2
+        elif op == "S":
+            apex = 1 << m
+            new[apex] = 0
+            for f, k in dims.items():
+                new[f] = k
+                new[f | apex] = k + 1
+            m += 1
+        else:
+            raise ValueError(f"operations must be 'H' or 'S', got {op!r}")
+        dims = new
+    return dims
+
+def facets(X):
+    """
+    Vertex sets of the facets of the convex hull of X (full-dimensional).
+    """
+    n, d = X.shape
+    if d == 0:
+        return []
+    if d == 1:
+        return [mask(X[:, 0] == X[:, 0].min()), mask(X[:, 0] == X[:, 0].max())]
+    from scipy.spatial import ConvexHull
+    hull = ConvexHull(X)
+    found = set()
+    for eq in hull.equations:
+        found.add(mask(np.abs(X @ eq[:-1] + eq[-1]) < TOL))
+    return sorted(found)
+
+def faces(X):
+    """
+    Every non-empty face of the convex hull of X, as a dict from vertex set
+    to dimension. Faces are the polytope itself and all intersections of facets.
+    Exponential in the dimension through Qhull; only for small figures.
+    """
+    top = facets(X)
+    found = set(top)
+    frontier = list(top)
+    while frontier:
+        new = []
+        for f in frontier:
+            for g in top:
+                h = f & g
+                if h and h not in found:
+                    found.add(h)
+                    new.append(h)
+        frontier = new
+    found.add((1 << X.shape[0]) - 1)
+    dims = {}
+    for f in found:
+        P = X[members(f)]
+        dims[f] = int(np.linalg.matrix_rank(P - P[0], tol=TOL)) if len(P) > 1 else 0
+    return dims
+
+def neighbor_masks(A):
+    A = sp.csr_matrix(A)
+    return [sum(1 << int(u) for u in A.indices[A.indptr[v]:A.indptr[v+1]])
+            for v in range(A.shape[0])]
+
+def _connected(f, nbrs):
+    reached = f & -f
+    frontier = reached
+    while frontier:
+        step = 0
+        for v in members(frontier):
+            step |= nbrs[v]
+        frontier = step & f & ~reached
+        reached |= frontier
+    return reached == f
+
+def validate(dims, nbrs):
+    """
+    Errors found checking faces against the adjacency: the 1-faces must be
+    exactly its edges, every k-face must induce a connected subgraph of
+    minimum degree at least k, a k-face on k + 1 vertices (a simplex) must
+    induce a clique, and the face counts must satisfy Euler's relation.
+    """
+    errors = []
+    euler = sum((-1)**k for k in dims.values())
+    if dims and euler != 1:
+        errors.append(f"alternating face count is {euler}, not 1")
+    edges = {(1 << u) | (1 << v) for u, row in enumerate(nbrs) for v in members(row) if u < v}
+    ones = {f for f, k in dims.items() if k == 1}
+    if ones != edges:
+        errors.append(f"{len(ones ^ edges)} edges differ between the faces and the adjacency")
+    for f, k in dims.items():
+        if k == 0:
+            continue
+        vs = members(f)
+        degree = min(bin(nbrs[v] & f).count("1") for v in vs)
+        if degree < k or not _connected(f, nbrs):
+            errors.append(f"{k}-face on {vs} is not {k}-connected in the adjacency")
+        elif len(vs) == k + 1 and degree != k:
+            errors.append(f"{k}-simplex on {vs} is not a clique in the adjacency")
+    return errors
+
+def figure_f_vector(dims, d):
+    counts = [0]*(d + 1)
+    for k in dims.values():
+        counts[k] += 1
+    return counts
+
+# -------------------------
+# Cross-check
+# -------------------------
+
+def check_sequence(sequence, trie=None, hull_limit=HULL_LIMIT):
+    """
+    Compares the faces found in the constructed figure's adjacency with both
+    polynomial engines for one run-length sequence, with the faces its H/S
+    steps predict, and with the convex hull of its embedding when it has at
+    most hull_limit vertices. Returns a report dict
+    whose "errors" list is empty when everything agrees.
+    """
+    sequence = tuple(sequence)
+    ops = sequence_to_ops(sequence)
+    nbrs = neighbor_masks(adjacency(sequence))
+    errors = []
+    try:
+        dims = graph_faces(nbrs)
+    except ValueError as e:
+        errors.append(str(e))
+        dims = {}
+    errors += validate(dims, nbrs)
+    predicted = figure_faces(ops)
+    if dims != predicted:
+        errors.append(f"{len(dims.items() ^ predicted.items())} faces differ between the adjacency and the H/S steps")
+    n = len(nbrs)
+    if n <= hull_limit:
+        hull = faces(embedding(ops))
+        if hull != dims:
+            errors.append(f"{len(hull.items() ^ dims.items())} faces differ between the figure and its convex hull")
+    figure = figure_f_vector(dims, len(ops))
+    runs = f_vector_runs(sequence)
+    array = (trie or FaceCountTrie()).f_vector(sequence)
+    if figure != runs:
+        errors.append(f"figure f-vector {figure} != f_vector_runs {runs}")
+    if array != runs:
+        errors.append(f"FaceCountTrie f-vector {array} != f_vector_runs {runs}")
+    return {"sequence": sequence, "f_vector": figure, "errors": errors}
+
+def _check_chunk(task):
+    sequences, hull_limit = task
+    trie = FaceCountTrie()
+    return [check_sequence(sequence, trie, hull_limit) for sequence in sequences]
+
+def random_sequences(count, max_ops=6, rng=None):
+    """
+    count random run-length sequences with at most max_ops operations in total.
+    """
+    rng = np.random.default_rng(rng)
+    sequences = []
+    for _ in range(count):
+        budget = int(rng.integers(0, max_ops + 1))
+        sequence = []
+        while budget:
+            a = int(rng.integers(0, budget + 1))
+            sequence.append(a)
+            budget -= a
+        sequences.append(tuple(sequence))
+    return sequences
+
+def sweep(count=200, max_ops=6, seed=0, processes=None, chunk_size=16, hull_limit=HULL_LIMIT):
+    """
+    Cross-checks count random sequences, spread over a multiprocessing pool
+    when processes > 1. Returns every report.
+    """
+    sequences = random_sequences(count, max_ops, seed)
+    chunks = [(sequences[i:i + chunk_size], hull_limit) for i in range(0, len(sequences), chunk_size)]
+    if processes is None or processes <= 1:
+        parts = [_check_chunk(chunk) for chunk in chunks]
+    else:
+        with multiprocessing.get_context().Pool(processes) as pool:
+            parts = pool.map(_check_chunk, chunks)
+    return [report for part in parts for report in part]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cross-check face-count polynomials against constructed figures.")
+    parser.add_argument("--count", type=int, default=200, help="random sequences to check")
+    parser.add_argument("--max-ops", type=int, default=6, help="operations per sequence at most")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--hull-limit", type=int, default=HULL_LIMIT,
+                        help="also check figures with at most this many vertices against Qhull")
+    args = parser.parse_args(argv)
+
+    reports = sweep(args.count, args.max_ops, args.seed, args.processes, hull_limit=args.hull_limit)
+    failed = [report for report in reports if report["errors"]]
+    for report in failed:
+        print(report["sequence"], *report["errors"], sep="\n  ")
+    print(f"{len(reports) - len(failed)}/{len(reports)} sequences agree")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Daniel Ketterer
+
+Spectral gap and mixing-time bounds of the random walk Normer(M) on the
+figures of HypercubeSimplexConstructor, with sparse iterative eigensolvers
+(Lanczos through eigsh for undirected figures, Arnoldi through eigs
+otherwise), so no dense eigen-decomposition is ever formed.
+
+For an undirected figure the column-stochastic walk P = M Deg^-1 is similar
+to the symmetric N = Deg^-1/2 M Deg^-1/2, which has the same eigenvalues,
+so Lanczos runs on N. Figures of the form K_m x Q_b (complete graph times
+hypercube, e.g. any run of S's followed by a run of H's) are regular
+Cartesian products, and their walk spectrum is assembled exactly from the
+factors instead.
+"""
+import math
+
+import numpy as np
+import scipy.sparse as sp
+
+from HypercubeSimplexConstructor import ImplicitFigure, Normer
+
+# Below this many vertices ARPACK cannot return the eigenvalues we need, and
+# a dense solve is trivial anyway.
+DENSE_LIMIT = 32
+
+# Offset of the shift-invert shifts from the ends of the spectrum, which are
+# themselves eigenvalues and would make the shifted system singular.
+SHIFT = 1e-8
+
+# -------------------------
+# Walk Operators
+# -------------------------
+
+def _adjacency(M):
+    if isinstance(M, ImplicitFigure):
+        M = M.tosparse()
+    return sp.csr_matrix(M, dtype=float)
+
+def is_symmetric(M):
+    return abs(M - M.T).max() == 0 if M.nnz else True
+
+def walk_operator(M, lazy=False):
+    """
+    The operator whose eigenvalues are those of the walk Normer(M):
+    the symmetric N for undirected M, Normer(M) itself otherwise.
+    lazy=True uses the lazy walk (I + P)/2. Returns (operator, symmetric).
+    """
+    M = _adjacency(M)
+    symmetric = is_symmetric(M)
+    deg = np.asarray(abs(M).sum(axis=0)).ravel()
+    if not deg.all():
+        raise ValueError("the walk needs every vertex to have a neighbour")
+    if symmetric:
+        scale = sp.diags(1/np.sqrt(deg))
+        W = (scale @ M @ scale).tocsr()
+    else:
+        W = Normer(M)
+    if lazy:
+        W = ((W + sp.identity(W.shape[0], format="csr"))/2).tocsr()
+    return W, symmetric
+
+# -------------------------
+# Eigenvalues
+# -------------------------
+
+def leading_eigenvalues(M, k=6, lazy=False, which="LA", shift_invert=False):
+    """
+    k eigenvalues of the walk on M, sorted in decreasing order ("LA", largest
+    algebraic) or increasing ("SA", smallest algebraic). For a directed M
+    these are by largest/smallest real part, as complex numbers.
+    shift_invert=True runs Lanczos in shift-invert mode just outside the
+    requested end of the spectrum. That converges far faster when the gap is
+    tiny (e.g. large grids), at the cost of a sparse LU factorization.
+    """
+    W, symmetric = walk_operator(M, lazy)
+    n = W.shape[0]
+    k = min(k, n)
+    if n <= DENSE_LIMIT:
+        vals = np.linalg.eigvalsh(W.toarray()) if symmetric else np.linalg.eigvals(W.toarray())
+    elif symmetric and shift_invert:
+        from scipy.sparse.linalg import eigsh
+        sigma = 1 + SHIFT if which == "LA" else (0 if lazy else -1) - SHIFT
+        vals = eigsh(W, k=k, sigma=sigma, which="LM", return_eigenvectors=False)
+    elif symmetric:
+        from scipy.sparse.linalg import eigsh
+        vals = eigsh(W, k=k, which=which, return_eigenvectors=False)
+    else:
+        from scipy.sparse.linalg import eigs
+        vals = eigs(W, k=k, which="LR" if which == "LA" else "SR", return_eigenvectors=False)
+    order = np.argsort(vals.real)
+    if which == "LA":
+        order = order[::-1]
+    return vals[order][:k]
+
+def spectral_gap(M, lazy=False, shift_invert=False):
+    """
+    Second largest eigenvalue, smallest eigenvalue, spectral gap 1 - lambda_2,
+    absolute gap 1 - max(|lambda_2|, |lambda_min|) and relaxation time
+    1/absolute gap (infinite for a periodic walk, e.g. a bipartite figure
+    without lazy=True).
+    """
+    top = leading_eigenvalues(M, 2, lazy, "LA", shift_invert)
+    bottom = leading_eigenvalues(M, 1, lazy, "SA", shift_invert)
+    lambda_2 = top[1] if len(top) > 1 else top[0]
+    lambda_min = bottom[0]
+    absolute = 1 - max(abs(lambda_2), abs(lambda_min))
+    absolute = max(float(np.real(absolute)), 0.0)
+    return {
+        "lambda_2": lambda_2,
+        "lambda_min": lambda_min,
+        "gap": float(np.real(1 - lambda_2)),
+        "absolute_gap": absolute,
+        "relaxation_time": 1/absolute if absolute > 1e-12 else math.inf,
+    }
+
+def mixing_time_bounds(relaxation_time, pi_min, eps=0.25):
+    """
+    Bounds on the eps-mixing time of a reversible walk from its relaxation
+    time and smallest stationary probability:
+    (t_rel - 1) log(1/(2 eps)) <= t_mix(eps) <= t_rel log(1/(eps pi_min)).
+    """
+    if math.isinf(relaxation_time):
+        return math.inf, math.inf
+    lower = (relaxation_time - 1)*math.log(1/(2*eps))
+    upper = relaxation_time*math.log(1/(eps*pi_min))
+    return lower, upper
+
+def analyze(M, lazy=False, eps=0.25, shift_invert=False):
+    """
+    Spectral gap and, for undirected figures, mixing-time bounds of the walk
+    on M. The stationary distribution of an undirected walk is deg/(2|E|).
+    """
+    A = _adjacency(M)
+    out = spectral_gap(A, lazy, shift_invert)
+    out["vertices"] = A.shape[0]
+    if is_symmetric(A):
+        deg = np.asarray(A.sum(axis=0)).ravel()
+        out["pi_min"] = float(deg.min()/deg.sum())
+        out["mixing_time"] = mixing_time_bounds(out["relaxation_time"], out["pi_min"], eps)
+    return out
+
+# -------------------------
+# Product Spectra
+# -------------------------
+# The walk on a Cartesian product G x H of a d-regular G and an e-regular H
+# has eigenvalues (d*lambda + e*mu)/(d + e) over all pairs of walk
+# eigenvalues lambda of G and mu of H, multiplicities multiplying.
+
+def complete_spectrum(m):
+    """
+    Walk eigenvalues and multiplicities of the complete graph K_m.
+    """
+    if m == 1:
+        return np.array([1.0]), np.array([1])
+    return np.array([1.0, -1/(m - 1)]), np.array([1, m - 1])
+
+def hypercube_spectrum(b):
+    """
+    Walk eigenvalues and multiplicities of the b-cube Q_b.
+    """
+    if b == 0:
+        return np.array([1.0]), np.array([1])
+    j = np.arange(b + 1)
+    return 1 - 2*j/b, np.array([math.comb(b, int(i)) for i in j])
+
+def cartesian_spectrum(first, second):
+    """
+    Walk spectrum of the Cartesian product of two regular graphs, each given
+    as (eigenvalues, multiplicities, degree). Returns the same triple.
+    """
+    (l1, m1, d1), (l2, m2, d2) = first, second
+    if d1 + d2 == 0:
+        return np.array([1.0]), np.array([1]), 0
+    vals = (d1*l1[:, None] + d2*l2[None, :])/(d1 + d2)
+    mult = m1[:, None]*m2[None, :]
+    # Group equal eigenvalues up to rounding, keeping one unrounded value each.
+    _, first, inverse = np.unique(np.round(vals.ravel(), 12), return_index=True, return_inverse=True)
+    counts = np.bincount(inverse, weights=mult.ravel()).astype(np.int64)
+    return vals.ravel()[first][::-1], counts[::-1], d1 + d2
+
+def product_form(ops):
+    """
+    (m, b) if the figure built by ops is K_m x Q_b, i.e. ops is at most one
+    operation, then S's, then H's; None otherwise.
+    """
+    ops = "".join(ops)
+    head = ops.rstrip("H")
+    b = len(ops) - len(head)
+    if head[1:].strip("S"):
+        return None
+    return len(head) + 1, b
+
+def product_spectrum(ops, lazy=False):
+    """
+    Exact walk eigenvalues (decreasing) and multiplicities of the figure
+    built by ops when it is K_m x Q_b, or None.
+    """
+    form = product_form(ops)
+    if form is None:
+        return None
+    m, b = form
+    vals, mult, _ = cartesian_spectrum((*complete_spectrum(m), m - 1), (*hypercube_spectrum(b), b))
+    if lazy:
+        vals = (1 + vals)/2
+    return vals, mult
+
+def figure_spectral_gap(ops, lazy=False):
+    """
+    spectral_gap of the figure built by ops, exactly from its factors when it
+    is a product and with sparse eigensolvers otherwise.
+    """
+    spectrum = product_spectrum(ops, lazy)
+    if spectrum is None:
+        return spectral_gap(ImplicitFigure(ops), lazy)
+    vals, mult = spectrum
+    lambda_2 = vals[1] if mult[0] == 1 and len(vals) > 1 else vals[0]
+    lambda_min = vals[-1]
+    absolute = max(1 - max(abs(lambda_2), abs(lambda_min)), 0.0)
+    return {
+        "lambda_2": lambda_2,
+        "lambda_min": lambda_min,
+        "gap": 1 - lambda_2,
+        "absolute_gap": absolute,
+        "relaxation_time": 1/absolute if absolute > 1e-12 else math.inf,
+    }
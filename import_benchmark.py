@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Daniel Ketterer
+
+Guards the import cost of the AbstractMath modules. Each module is imported
+in a fresh interpreter, timed, and checked to print nothing and to leave the
+heavy optional dependencies (sympy, networkx, matplotlib) unimported.
+Exits non-zero when a module fails a check or exceeds its time budget.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODULES = [
+    "rubiks_hypercube",
+    "rubiks_solver",
+    "rubiks_benchmark",
+    "rubiks_profile",
+    "rubiks_layout",
+    "HypercubeRandomWalk",
+    "HypercubeSimplexConstructor",
+    "IterativeOperations",
+    "face_check",
+    "figure_spectrum",
+    "absorption_sweep",
+    "query_service",
+]
+
+HEAVY = ["sympy", "networkx", "matplotlib"]
+
+# numpy is imported before the clock starts, since every module needs it.
+_PROBE = """
+import io, json, sys, time
+import numpy
+out = io.StringIO()
+sys.stdout = out
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+sys.stdout = sys.__stdout__
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"seconds": seconds, "heavy": heavy, "output": out.getvalue()}}))
+"""
+
+def measure(module, repeat=3):
+    """
+    Best-of-repeat import time of module in fresh interpreters, with the heavy
+    modules it pulled in and anything it printed.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY)],
+                              capture_output=True, text=True, cwd=here)
+        if proc.returncode != 0:
+            return {"module": module, "error": proc.stderr.strip().splitlines()[-1]}
+        row = json.loads(proc.stdout.splitlines()[-1])
+        if best is None or row["seconds"] < best["seconds"]:
+            best = row
+    best["module"] = module
+    return best
+
+def problems(row, budget):
+    if "error" in row:
+        return [row["error"]]
+    found = []
+    if row["heavy"]:
+        found.append(f"imports {', '.join(row['heavy'])}")
+    if row["output"]:
+        found.append("prints at import time")
+    if row["seconds"] > budget:
+        found.append(f"took {row['seconds']:.3f}s, budget {budget:.3f}s")
+    return found
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check import time and side effects of the modules.")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds allowed per module")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for module in args.modules:
+        row = measure(module, args.repeat)
+        found = problems(row, args.budget)
+        failed += bool(found)
+        seconds = f"{row['seconds']:.3f}s" if "seconds" in row else "-"
+        print(f"{module:<28} {seconds:>8}  {'; '.join(found) or 'ok'}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
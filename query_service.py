@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Daniel Ketterer
+
+A long-running local service for TDM, absorption times and face counts, so
+short-lived jobs neither re-import numpy/scipy nor recompute answers another
+job already asked for. JSON over HTTP/1.1 on localhost or a Unix socket:
+
+    python query_service.py --port 8765
+    python query_service.py --unix /tmp/abstractmath.sock
+
+    POST /tdm         {"a": [...], "b": [...], "c": [...], "d": [...], "backend": "thomas"}
+    POST /absorption  {"ops": "HHS"} or {"matrix": [[...]]}, with "w" and "method"
+    POST /faces       {"sequence": [2, 1, 3]} or {"ops": "HHS"}, with "modulus"
+    GET  /stats
+
+Identical concurrent requests share one computation. Compatible requests
+arriving within a short window are solved as one batch: TDM systems of one
+size in a single batched Thomas sweep, absorbing vertices of one figure with
+one LU factorization. Encoded responses are kept in an LRU cache bounded in
+bytes. request() is a client that only needs the standard library.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import socket
+import sys
+import time
+
+# numpy, scipy and the figure modules are imported by the solvers on first
+# use, so the client side of this module stays as cheap as the stdlib.
+
+BATCH_WINDOW = 0.002  # seconds a new batch waits for compatible requests
+MAX_BATCH = 256
+CACHE_BYTES = 64*2**20
+LATENCY_WINDOW = 4096  # recent latencies kept per endpoint for quantiles
+
+# -------------------------
+# Endpoints
+# -------------------------
+# Each endpoint has params(payload) -> canonical parameters (raising
+# ValueError on bad input), group(params) -> batch key of compatible
+# requests, and solve(list of params) -> list of results.
+
+def _field(payload, name):
+    if name not in payload:
+        raise ValueError(f"missing field {name!r}")
+    return payload[name]
+
+def _tdm_params(payload):
+    a, b, c, d = ([float(x) for x in _field(payload, name)] for name in "abcd")
+    backend = payload.get("backend", "thomas")
+    if backend not in ("thomas", "lapack"):
+        raise ValueError(f"backend must be 'thomas' or 'lapack', got {backend!r}")
+    if not a or min(len(b), len(c), len(d)) < len(a):
+        raise ValueError("b, c and d need at least len(a) > 0 entries")
+    return {"a": a, "b": b, "c": c, "d": d, "backend": backend}
+
+def _tdm_group(p):
+    return (p["backend"],) + tuple(len(p[name]) for name in "abcd")
+
+def _tdm_solve(batch):
+    import numpy as np
+    from HypercubeRandomWalk import TDM
+    a, b, c, d = (np.array([p[name] for p in batch]) for name in "abcd")
+    x = TDM(a, b, c, d, batch[0]["backend"])
+    return [{"x": row.tolist()} for row in x]
+
+def _ops_string(ops):
+    ops = "".join(ops)
+    if ops.strip("HS"):
+        raise ValueError(f"operations must be 'H' or 'S', got {ops!r}")
+    return ops
+
+def _absorption_params(payload):
+    w = int(payload.get("w", 0))
+    if "ops" in payload:
+        method = payload.get("method", "lumped")
+        if method not in ("lumped", "lu", "cg", "gmres"):
+            raise ValueError(f"unknown method {method!r}")
+        return {"ops": _ops_string(payload["ops"]), "w": w, "method": method}
+    matrix = [[float(x) for x in row] for row in _field(payload, "matrix")]
+    if any(len(row) != len(matrix) for row in matrix):
+        raise ValueError("matrix must be square")
+    method = payload.get("method", "lu")
+    if method not in ("lu", "cg", "gmres"):
+        raise ValueError(f"unknown method {method!r}")
+    return {"matrix": matrix, "w": w, "method": method}
+
+def _absorption_group(p):
+    # Every w of one figure goes to the same solver.
+    source = p.get("ops")
+    if source is None:
+        source = json.dumps(p["matrix"])
+    return (source, p["method"])
+
+def _absorption_solve(batch):
+    from HypercubeSimplexConstructor import AbsorptionSolver, ImplicitFigure, LumpedAbsorption
+    first = batch[0]
+    fig = ImplicitFigure(first["ops"]) if "ops" in first else None
+    if fig is not None and first["method"] == "lumped":
+        return [{"times": LumpedAbsorption(fig, p["w"]).vertex_times().tolist()} for p in batch]
+    M = fig.tosparse() if fig is not None else first["matrix"]
+    solver = AbsorptionSolver(M, first["method"])
+    return [{"times": solver.vertex_times(p["w"]).tolist()} for p in batch]
+
+def _runs(ops):
+    """
+    Run-length sequence of an operation string, starting with a run of H.
+    """
+    sequence = []
+    for i, op in enumerate(ops):
+        if i == 0 and op == "S":
+            sequence.append(0)
+        if i == 0 or op != ops[i - 1]:
+            sequence.append(0)
+        sequence[-1] += 1
+    return sequence
+
+def _faces_params(payload):
+    if "ops" in payload:
+        sequence = _runs(_ops_string(payload["ops"]))
+    else:
+        sequence = [int(a) for a in _field(payload, "sequence")]
+    modulus = payload.get("modulus")
+    return {"sequence": sequence, "modulus": None if modulus is None else int(modulus)}
+
+def _faces_group(p):
+    return (p["modulus"],)
+
+def _faces_solve(batch):
+    from IterativeOperations import f_vector_runs
+    return [{"f_vector": f_vector_runs(p["sequence"], p["modulus"])} for p in batch]
+
+ENDPOINTS = {
+    "/tdm": (_tdm_params, _tdm_group, _tdm_solve),
+    "/absorption": (_absorption_params, _absorption_group, _absorption_solve),
+    "/faces": (_faces_params, _faces_group, _faces_solve),
+}
+
+# Failures of a single request, reported to the client as 400.
+def _request_errors():
+    import numpy as np
+    return (ValueError, TypeError, IndexError, np.linalg.LinAlgError)
+
+# -------------------------
+# Cache and Statistics
+# -------------------------
+
+class LRUCache:
+    """
+    Encoded responses by request key, evicting the least recently used once
+    their total size exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        body = self.entries.get(key)
+        if body is not None:
+            self.entries.move_to_end(key)
+        return body
+
+    def put(self, key, body):
+        size = len(body) + len(key)
+        if size > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old) + len(key)
+        self.entries[key] = body
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            k, v = self.entries.popitem(last=False)
+            self.bytes -= len(v) + len(k)
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.computed = 0
+        self.batches = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def report(self, uptime):
+        out = {
+            "requests": self.requests,
+            "errors": self.errors,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "computed": self.computed,
+            "batches": self.batches,
+            "mean_batch": self.computed/self.batches if self.batches else 0.0,
+            "throughput": self.requests/uptime if uptime > 0 else 0.0,
+        }
+        if self.latencies:
+            ordered = sorted(self.latencies)
+            for q in (0.5, 0.9, 0.99):
+                out[f"p{round(100*q)}_ms"] = 1e3*ordered[min(int(q*len(ordered)), len(ordered) - 1)]
+            out["max_ms"] = 1e3*ordered[-1]
+        return out
+
+# -------------------------
+# Service
+# -------------------------
+
+class QueryService:
+    """
+    Answers endpoint queries, coalescing identical ones in flight, batching
+    compatible ones for batch_window seconds (or max_batch requests), and
+    caching encoded responses. Batches run in the loop's default executor,
+    so the server keeps accepting requests while one is solved.
+    """
+
+    def __init__(self, cache_bytes=CACHE_BYTES, batch_window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.cache = LRUCache(cache_bytes)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.stats = {name: EndpointStats() for name in ENDPOINTS}
+        self.started = time.monotonic()
+        self._inflight = {}
+        self._pending = {}
+
+    async def query(self, endpoint, payload):
+        """
+        The encoded JSON response to payload at endpoint. Raises the
+        solver's error for a bad request.
+        """
+        start = time.perf_counter()
+        stats = self.stats[endpoint]
+        stats.requests += 1
+        try:
+            params = ENDPOINTS[endpoint][0](payload)
+            key = endpoint + json.dumps(params, sort_keys=True)
+            body = self.cache.get(key)
+            if body is not None:
+                stats.cache_hits += 1
+            elif key in self._inflight:
+                stats.coalesced += 1
+                body = await asyncio.shield(self._inflight[key])
+            else:
+                future = asyncio.get_running_loop().create_future()
+                self._inflight[key] = future
+                self._enqueue(endpoint, params, key, future)
+                try:
+                    body = await asyncio.shield(future)
+                finally:
+                    self._inflight.pop(key, None)
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.latencies.append(time.perf_counter() - start)
+        return body
+
+    def _enqueue(self, endpoint, params, key, future):
+        group = (endpoint, ENDPOINTS[endpoint][1](params))
+        batch = self._pending.get(group)
+        if batch is None:
+            batch = self._pending[group] = []
+            asyncio.get_running_loop().call_later(self.batch_window, self._flush, group, batch)
+        batch.append((params, key, future))
+        if len(batch) >= self.max_batch:
+            self._flush(group, batch)
+
+    def _flush(self, group, batch):
+        if self._pending.get(group) is not batch:
+            return
+        del self._pending[group]
+        stats = self.stats[group[0]]
+        stats.batches += 1
+        stats.computed += len(batch)
+        asyncio.ensure_future(self._run(group[0], batch))
+
+    async def _run(self, endpoint, batch):
+        solve = ENDPOINTS[endpoint][2]
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(None, solve, [params for params, _, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][2].set_exception(e)
+            else:
+                # One bad request must not fail the others: solve them one by one.
+                for item in batch:
+                    await self._run(endpoint, [item])
+            return
+        for (_, key, future), result in zip(batch, results):
+            self._resolve(key, future, result)
+
+    def _resolve(self, key, future, result):
+        body = json.dumps(result).encode()
+        self.cache.put(key, body)
+        if not future.done():
+            future.set_result(body)
+
+    def report(self):
+        uptime = time.monotonic() - self.started
+        return {
+            "uptime": uptime,
+            "cache": {"entries": len(self.cache.entries), "bytes": self.cache.bytes,
+                      "max_bytes": self.cache.max_bytes},
+            "endpoints": {name: stats.report(uptime) for name, stats in self.stats.items()},
+        }
+
+    # -------------------------
+    # HTTP
+    # -------------------------
+
+    async def handle(self, reader, writer):
+        """
+        Serves HTTP/1.1 requests on one connection until the client closes it.
+        """
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                method, path, _ = (lines[0].split(" ", 2) + ["", ""])[:3]
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, response = await self._respond(method, path, body)
+                writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n" % (status, _REASONS[status], len(response)))
+                writer.write(response)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    return
+        finally:
+            writer.close()
+
+    async def _respond(self, method, path, body):
+        if path == "/stats" and method == "GET":
+            return 200, json.dumps(self.report()).encode()
+        if path not in ENDPOINTS:
+            return 404, _error(f"unknown endpoint {path}")
+        if method != "POST":
+            return 405, _error("use POST")
+        try:
+            payload = json.loads(body or b"{}")
+            if not isinstance(payload, dict):
+                raise ValueError("the request body must be a JSON object")
+            return 200, await self.query(path, payload)
+        except json.JSONDecodeError as e:
+            return 400, _error(f"invalid JSON: {e}")
+        except _request_errors() as e:
+            return 400, _error(str(e))
+        except Exception as e:
+            return 500, _error(f"{type(e).__name__}: {e}")
+
+_REASONS = {200: b"OK", 400: b"Bad Request", 404: b"Not Found", 405: b"Method Not Allowed",
+            500: b"Internal Server Error"}
+
+def _error(message):
+    return json.dumps({"error": message}).encode()
+
+async def serve(host="127.0.0.1", port=8765, unix=None, **kwargs):
+    """
+    Runs a QueryService until cancelled, on a Unix socket if unix is given
+    and on host:port otherwise.
+    """
+    service = QueryService(**kwargs)
+    if unix is not None:
+        server = await asyncio.start_unix_server(service.handle, path=unix)
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+# -------------------------
+# Client
+# -------------------------
+
+def request(path, payload=None, host="127.0.0.1", port=8765, unix=None, timeout=None):
+    """
+    Sends one query (a GET when payload is None) and returns the decoded
+    response. Raises ValueError with the service's message on an error.
+    """
+    body = b"" if payload is None else json.dumps(payload).encode()
+    method = "GET" if payload is None else "POST"
+    if unix is not None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(unix)
+    else:
+        sock = socket.create_connection((host, port), timeout)
+    with sock:
+        sock.sendall(b"%s %s HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n"
+                     b"Content-Type: application/json\r\nContent-Length: %d\r\n\r\n"
+                     % (method.encode(), path.encode(), len(body)) + body)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    head, _, data = b"".join(chunks).partition(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    result = json.loads(data)
+    if status != 200:
+        raise ValueError(result.get("error", f"HTTP {status}"))
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve TDM, absorption times and face counts.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="listen on this Unix socket instead")
+    parser.add_argument("--cache-mb", type=float, default=CACHE_BYTES/2**20)
+    parser.add_argument("--batch-window", type=float, default=BATCH_WINDOW, help="seconds")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, cache_bytes=int(args.cache_mb*2**20),
+                          batch_window=args.batch_window, max_batch=args.max_batch))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Daniel Ketterer
+
+Benchmarks the rubiks_hypercube move code over a grid of (D, s) values and
+move kinds (Slice == 1 face moves versus inner-slice moves), writing JSON
+results that can be compared between commits.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from rubiks_hypercube import (HypercubeState, axis_move, cube_move, flip,
+                              initial_cube, move_table, other_move, position)
+
+# -------------------------
+# Operations
+# -------------------------
+# Each operation takes (move, context) and performs one unit of work the
+# way cube_move would for that move.
+
+def _face_index(move):
+    Face = move[0]
+    return (Face + (Face % 2)) // 2
+
+def _flip_axis(move):
+    Face, AxisFrom, AxisTo, Slice = move
+    to = AxisTo // 2
+    if AxisTo > Face:
+        to = to - 1
+    return to - 1
+
+def op_position(move, ctx):
+    position(_face_index(move), ctx["s"], ctx["D"], move[3])
+
+def op_flip(move, ctx):
+    flip(_face_index(move), ctx["s"], ctx["D"] - 1, move[3], _flip_axis(move))
+
+def op_other_move(move, ctx):
+    ctx["cube"] = other_move(*move, ctx["cube"], ctx["D"], ctx["s"])
+
+def op_axis_move(move, ctx):
+    ctx["cube"] = axis_move(*move, ctx["cube"], ctx["D"], ctx["s"])
+
+def op_cube_move(move, ctx):
+    ctx["cube"] = cube_move(*move, ctx["cube"], ctx["D"], ctx["s"])
+
+def op_compiled(move, ctx):
+    ctx["state"] = ctx["table"].apply(move, ctx["state"])
+
+OPERATIONS = {
+    "position": op_position,
+    "flip": op_flip,
+    "other_move": op_other_move,
+    "axis_move": op_axis_move,
+    "cube_move": op_cube_move,
+    "compiled": op_compiled,
+}
+
+MOVE_KINDS = {
+    "face": lambda move: move[3] == 1,
+    "inner": lambda move: move[3] > 1,
+}
+
+# -------------------------
+# Measurement
+# -------------------------
+
+def _context(D, s, table):
+    return {
+        "D": D,
+        "s": s,
+        "table": table,
+        "cube": initial_cube(D, s),
+        "state": HypercubeState.solved(D, s).stickers,
+    }
+
+def time_operation(op, moves, ctx, min_time=0.2):
+    """
+    Runs op over moves, cycling, until min_time has passed.
+    Returns (number of moves, elapsed seconds).
+    """
+    count = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        for move in moves:
+            op(move, ctx)
+        count += len(moves)
+        elapsed = time.perf_counter() - start
+    return count, elapsed
+
+def trace_operation(op, moves, ctx):
+    """
+    Runs op once per move under tracemalloc. Returns the peak traced bytes
+    of the whole run, the mean transient bytes a move allocates on top of
+    what was live before it, and the mean net allocated blocks per move.
+    """
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        transient = 0
+        peak = 0
+        blocks_before = sys.getallocatedblocks()
+        for move in moves:
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            op(move, ctx)
+            move_peak = tracemalloc.get_traced_memory()[1]
+            transient += move_peak - current
+            peak = max(peak, move_peak - base)
+        blocks = sys.getallocatedblocks() - blocks_before
+    finally:
+        tracemalloc.stop()
+    return peak, transient / len(moves), blocks / len(moves)
+
+def bench_case(D, s, kind, operation, table, min_time=0.2, sample=64, seed=0):
+    """
+    Benchmarks one (D, s, move kind, operation) cell of the grid.
+    """
+    moves = [move for move in table.moves if MOVE_KINDS[kind](move)]
+    if not moves:
+        return None
+    rng = np.random.default_rng(seed)
+    moves = [moves[i] for i in rng.integers(0, len(moves), size=sample)]
+    op = OPERATIONS[operation]
+    count, elapsed = time_operation(op, moves, _context(D, s, table), min_time)
+    peak, transient, blocks = trace_operation(op, moves, _context(D, s, table))
+    return {
+        "D": D,
+        "s": s,
+        "kind": kind,
+        "operation": operation,
+        "moves": count,
+        "seconds": elapsed,
+        "latency_us": 1e6 * elapsed / count,
+        "moves_per_sec": count / elapsed,
+        "peak_bytes": peak,
+        "transient_bytes_per_move": transient,
+        "net_blocks_per_move": blocks,
+    }
+
+def run_grid(dims, slices, kinds=tuple(MOVE_KINDS), operations=tuple(OPERATIONS),
+             min_time=0.2, sample=64, seed=0, log=None):
+    results = []
+    for D in dims:
+        for s in slices:
+            start = time.perf_counter()
+            table = move_table(D, s)
+            compile_seconds = time.perf_counter() - start
+            for kind in kinds:
+                for operation in operations:
+                    row = bench_case(D, s, kind, operation, table, min_time, sample, seed)
+                    if row is None:
+                        continue
+                    row["compile_seconds"] = compile_seconds
+                    results.append(row)
+                    if log is not None:
+                        log(row)
+    return results
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+    }
+
+# -------------------------
+# Reporting
+# -------------------------
+
+def _key(row):
+    return (row["D"], row["s"], row["kind"], row["operation"])
+
+def format_row(row):
+    return (f"D={row['D']:<2} s={row['s']:<2} {row['kind']:<5} {row['operation']:<10} "
+            f"{row['latency_us']:>12.2f} us/move {row['moves_per_sec']:>14.0f} moves/s "
+            f"peak {row['peak_bytes'] / 1024:>10.1f} KiB "
+            f"{row['transient_bytes_per_move'] / 1024:>9.1f} KiB/move")
+
+def compare(baseline, current):
+    """
+    Lines comparing latency of matching cells, as current/baseline ratios.
+    """
+    base = {_key(row): row for row in baseline["results"]}
+    lines = []
+    for row in current["results"]:
+        old = base.get(_key(row))
+        if old is None:
+            continue
+        ratio = row["latency_us"] / old["latency_us"]
+        lines.append(f"D={row['D']:<2} s={row['s']:<2} {row['kind']:<5} {row['operation']:<10} "
+                     f"{old['latency_us']:>12.2f} -> {row['latency_us']:>12.2f} us/move  x{ratio:.2f}")
+    return lines
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark rubiks_hypercube moves.")
+    parser.add_argument("--dims", type=int, nargs="+", default=[3, 4, 5])
+    parser.add_argument("--slices", type=int, nargs="+", default=[2, 3, 4])
+    parser.add_argument("--kinds", nargs="+", choices=list(MOVE_KINDS), default=list(MOVE_KINDS))
+    parser.add_argument("--operations", nargs="+", choices=list(OPERATIONS), default=list(OPERATIONS))
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per cell")
+    parser.add_argument("--sample", type=int, default=64, help="moves drawn per cell")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    args = parser.parse_args(argv)
+
+    results = run_grid(args.dims, args.slices, args.kinds, args.operations,
+                       args.min_time, args.sample, args.seed,
+                       log=lambda row: print(format_row(row)))
+    report = {"metadata": metadata(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        print("\n".join(compare(baseline, report)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,12 @@
 """
 @author: Daniel Ketterer
 """
+import argparse
+import hashlib
+import math
+import sys
+import time
+
 import numpy as np
 
 # -------------------------
@@ -52,12 +58,42 @@ def get_int(prompt, min_val=None, max_val=None):
 # -------------------------
 # The Main Computational Functions
 # -------------------------
+# Copies and sticker gathers/scatters go through the small helpers below so
+# that rubiks_profile can time them as phases of a move.
+
+def _copy(A):
+    return A.copy()
+
+def _gather(O, z, n_iter):
+    """
+    The stickers of O at the 1-based flat positions z[:n_iter].
+    """
+    B_sub = np.empty(n_iter, dtype=O.dtype)
+    for i_idx in range(n_iter):
+        B_sub[i_idx] = O.flat[int(z[i_idx]) - 1]
+    return B_sub
+
+def _scatter(O, z, values, n_iter):
+    """
+    Writes values into O at the 1-based flat positions z[:n_iter].
+    """
+    for i_idx in range(n_iter):
+        O.flat[int(z[i_idx]) - 1] = values[i_idx]
+
+def _scatter_flipped(dst, src, z, z2, n_iter):
+    """
+    Moves src's stickers at positions z to the positions of z picked by the
+    flipped positions z2, as in the second loop of 'AxisMove'.
+    """
+    for i_idx in range(n_iter):
+        pos_index = int(z2[i_idx]) - 1
+        if pos_index < len(z):
+            dst.flat[int(z[pos_index]) - 1] = src.flat[int(z[i_idx]) - 1]
 
 def position(FaceI, s, D, Slice):
     """
     Computes positions
     """
-    ###print(f"[DEBUG] position() called with FaceI={FaceI}, s={s}, D={D}, Slice={Slice}")
     y = [0] * D
     y[FaceI - 1] = Slice
     index = 0 if FaceI != 1 else 1
@@ -67,37 +103,29 @@ def position(FaceI, s, D, Slice):
         ysum = 0
         for n in range(1, D):  # n = 1,...,D-1
             ysum += y[n - 1] * (s ** (n - 1))
-        ###print(f"[DEBUG] position() loop: y={y}, index={index}, computed ysum={ysum}")
         z.append(ysum)
         while index < D and y[index] == s - 1:
-            ###print(f"[DEBUG] position() inner while: y[{index}] == {s - 1}, resetting y[{index}] to 0")
             y[index] = 0
             if (index + 1) != FaceI:
                 index += 1
             else:
                 index += 2
-            ###print(f"[DEBUG] position() inner while: Updated index={index}, y now {y}")
         if index < D:
             y[index] += 1
-            ###print(f"[DEBUG] position(): Incremented y[{index}] to {y[index]}")
             index = 0 if FaceI != 1 else 1
-            ###print(f"[DEBUG] position() reset index to {index}")
-    ###print(f"[DEBUG] position() returning z: {z}")
     return z
 
 def flip(FaceI, s, D, Slice, FlipAxis):
     """
     Computes the flipped positions as in the MATLAB 'Flip' function.
     """
-    ###print(f"[DEBUG] flip() called with FaceI={FaceI}, s={s}, D={D}, Slice={Slice}, FlipAxis={FlipAxis}")
     iter_val = 1
     B = np.array([[1]])
     for i in range(1, D):
-        T = B.copy()
+        T = _copy(B)
         for j in range(1, s):
             B = cat(i, B, T + iter_val)
             iter_val = iter_val + s ** (i - 1)
-            ###print(f"[DEBUG] flip() cat loop: i={i}, j={j}, iter_val={iter_val}, B=\n{B}")
     y = [0] * D
     index = 0
     z2 = []
@@ -108,63 +136,49 @@ def flip(FaceI, s, D, Slice, FlipAxis):
                 ysum += y[n - 1] * (s ** (n - 1))
             else:
                 ysum += ((s - 1) - y[n - 1]) * (s ** (n - 1))
-        ###print(f"[DEBUG] flip() loop: y={y}, index={index}, computed ysum={ysum}")
         z2.append(ysum)
         while index < D and y[index] == s - 1:
-            ###print(f"[DEBUG] flip() inner while: y[{index}] == {s - 1}, resetting y[{index}] to 0")
             y[index] = 0
             index += 1
-            ###print(f"[DEBUG] flip() inner while: Updated index={index}, y now {y}")
         if index < D:
             y[index] += 1
-            ###print(f"[DEBUG] flip(): Incremented y[{index}] to {y[index]}")
             index = 0
-            ###print(f"[DEBUG] flip() reset index to {index}")
     z2 = [val + 1 for val in z2]  # Adjust for MATLAB's 1-indexing.
-    ###print(f"[DEBUG] flip() returning z2: {z2}")
     return z2
 
 def face_move(Face, AxisFrom, AxisTo, Slice, Cube, D, s):
     """
     Performs the face move, similar to MATLAB 'FaceMove'.
     """
-    ###print(f"[DEBUG] face_move() called with Face={Face}, AxisFrom={AxisFrom}, AxisTo={AxisTo}, Slice={Slice}, D={D}, s={s}")
     fr = AxisFrom // 2
     to = AxisTo // 2
     if Face < AxisFrom:
         fr = fr - 1
     if Face < AxisTo:
         to = to - 1
-    A = Cube[Face - 1].copy()
-    ###print(f"[DEBUG] face_move(): Original face (index {Face - 1}) A:\n{A}")
+    A = _copy(Cube[Face - 1])
     if A.ndim < 3 or max(fr, to) >= A.ndim:
-        ###print(f"[DEBUG] face_move(): Using np.rot90 because condition met (A.ndim={A.ndim}, fr={fr}, to={to})")
         if fr<to:
             A = np.rot90(A, k=-1)
         else:
             A = np.rot90(A, k=1)
     else:
-        ###print(f"[DEBUG] face_move(): Using rotdim with k=-1 on axes ({fr}, {to})")
         A = rotdim(A, -1, (fr, to))
     Cube[Face - 1] = A
-    ###print(f"[DEBUG] face_move(): Updated Cube face (index {Face - 1}) A:\n{A}")
     return Cube
 
 def other_move(Face, AxisFrom, AxisTo, Slice, Cube, D, s):
     """
     Performs other moves as in MATLAB 'OtherMove'.
     """
-    ###print(f"[DEBUG] other_move() called with Face={Face}, AxisFrom={AxisFrom}, AxisTo={AxisTo}, Slice={Slice}, D={D}, s={s}")
     iter_val = 1
     B = np.array([[1]])
     for i in range(1, D - 1):
-        T = B.copy()
+        T = _copy(B)
         for j in range(1, s):
             B = cat(i, B, T + iter_val)
             iter_val = iter_val + s ** (i - 1)
-            ###print(f"[DEBUG] other_move() cat loop: i={i}, j={j}, iter_val={iter_val}, B=\n{B}")
     for a in range(1, 2 * D + 1):
-        ###print(f"[DEBUG] other_move(): Processing face a={a}")
         fr = AxisFrom // 2
         to = AxisTo // 2
         FaceI = (Face + (Face % 2)) // 2
@@ -177,89 +191,59 @@ def other_move(Face, AxisFrom, AxisTo, Slice, Cube, D, s):
         if (a != AxisFrom and a != AxisTo and a != (AxisFrom - 1)
             and a != (AxisTo - 1) and a != Face):
             if ((Face % 2 == 1 and a != Face + 1) or (Face % 2 == 0 and a != Face - 1)):
-                O = Cube[a - 1].copy()
-                ###print(f"[DEBUG] other_move(): Original Cube face at index {a-1} O:\n{O}")
+                O = _copy(Cube[a - 1])
                 z = position(FaceI, s, D, Slice)
-                ###print(f"[DEBUG] other_move(): Computed position z: {z}")
                 n_iter = s ** (D - 2) if D - 2 > 0 else 1
-                B_sub = np.empty(n_iter, dtype=O.dtype)
-                for i_idx in range(n_iter):
-                    idx = int(z[i_idx]) - 1
-                    ###print(f"[DEBUG] other_move(): a={a}, i_idx={i_idx}, z[i_idx]={z[i_idx]}, computed idx={idx}")
-                    B_sub[i_idx] = O.flat[idx]
-                    ###print(f"[DEBUG] other_move(): a={a}, i_idx={i_idx}, extracted O.flat[{idx}] = {O.flat[idx]}")
-                ###print(f"[DEBUG] other_move(): B_sub before rotation: {B_sub}")
+                B_sub = _gather(O, z, n_iter)
                 fr_adj = fr - 1
                 to_adj = to - 1
                 if B_sub.ndim < 2:
                     B_sub = B_sub.reshape(1, -1)
                     B_rot = np.rot90(B_sub, k=-1).flatten()
-                    ###print(f"[DEBUG] other_move(): B_sub reshaped and rotated using np.rot90:\n{B_rot}")
                 else:
                     B_rot = rotdim(B_sub, -1, (fr_adj, to_adj))
-                    ###print(f"[DEBUG] other_move(): B_sub rotated using rotdim:\n{B_rot}")
-                for i_idx in range(n_iter):
-                    idx = int(z[i_idx]) - 1
-                    O.flat[idx] = B_rot[i_idx]
-                    ###print(f"[DEBUG] other_move(): a={a}, i_idx={i_idx}, assigned B_rot[{i_idx}] = {B_rot[i_idx]} to O.flat[{idx}]")
+                _scatter(O, z, B_rot, n_iter)
                 Cube[a - 1] = O
-                ###print(f"[DEBUG] other_move(): Updated Cube face at index {a-1} O:\n{O}")
     return Cube
 
 def axis_move(Face, AxisFrom, AxisTo, Slice, Cube, D, s):
     """
     Performs other moves as in MATLAB 'AxisMove'.
     """
-    ###print(f"[DEBUG] axis_move() called with Face={Face}, AxisFrom={AxisFrom}, AxisTo={AxisTo}, Slice={Slice}, D={D}, s={s}")
     iter_val = 1
     FaceI = (Face + (Face % 2)) // 2
     iter_val = 1
     B = np.array([[1]])
     for i in range(1, D - 1):
-        T = B.copy()
+        T = _copy(B)
         for j in range(1, s):
             B = cat(i, B, T + iter_val)
             iter_val = iter_val + s ** (i - 1)
-            ###print(f"[DEBUG] axis_move() cat loop: i={i}, j={j}, iter_val={iter_val}, B=\n{B}")
     
     z = position(FaceI, s, D, Slice)
-    ###print(f"[DEBUG] axis_move(): Computed position z: {z}")
     
-    C = Cube[AxisFrom - 1].copy()
-    D1 = Cube[AxisTo - 1].copy()
-    E = Cube[AxisFrom - 2].copy()  # Corresponds to MATLAB's Cube{AxisFrom-1}
-    F_arr = Cube[AxisTo - 2].copy()
+    C = _copy(Cube[AxisFrom - 1])
+    D1 = _copy(Cube[AxisTo - 1])
+    E = _copy(Cube[AxisFrom - 2])  # Corresponds to MATLAB's Cube{AxisFrom-1}
+    F_arr = _copy(Cube[AxisTo - 2])
     
-    """print(f"[DEBUG] axis_move(): Initial arrays shapes and values:\n"
-          f"C (index {AxisFrom-1}):\n{C}\n"
-          f"D1 (index {AxisTo-1}):\n{D1}\n"
-          f"E (index {AxisFrom-2}):\n{E}\n"
-          f"F_arr (index {AxisTo-2}):\n{F_arr}")
-    """
-    G = C.copy()
-    H = D1.copy()
-    I_arr = E.copy()
-    J = F_arr.copy()
+    G = _copy(C)
+    H = _copy(D1)
+    I_arr = _copy(E)
+    J = _copy(F_arr)
     
     n_iter = s ** (D - 2) if D - 2 > 0 else 1
     
     # Loop 1: Reassign elements among the affected faces.
-    for i_idx in range(n_iter):
-        idx = int(z[i_idx]) - 1
-        ###print(f"[DEBUG] axis_move(): Loop1, i_idx={i_idx}, z[i_idx]={z[i_idx]}, computed idx={idx}")
-        G.flat[idx] = F_arr.flat[idx]
-        H.flat[idx] = C.flat[idx]
-        I_arr.flat[idx] = D1.flat[idx]
-        J.flat[idx] = E.flat[idx]
-        """print(f"[DEBUG] axis_move(): After assignment at idx={idx}: "
-              f"G.flat[{idx}]={G.flat[idx]}, H.flat[{idx}]={H.flat[idx]}, "
-              f"I_arr.flat[{idx}]={I_arr.flat[idx]}, J.flat[{idx}]={J.flat[idx]}")
-    """
+    _scatter(G, z, _gather(F_arr, z, n_iter), n_iter)
+    _scatter(H, z, _gather(C, z, n_iter), n_iter)
+    _scatter(I_arr, z, _gather(D1, z, n_iter), n_iter)
+    _scatter(J, z, _gather(E, z, n_iter), n_iter)
     # Update working copies after loop1.
-    C = G.copy()
-    D1 = H.copy()
-    E = I_arr.copy()
-    F_arr = J.copy()
+    C = _copy(G)
+    D1 = _copy(H)
+    E = _copy(I_arr)
+    F_arr = _copy(J)
     
     fr = AxisFrom // 2
     to = AxisTo // 2
@@ -271,29 +255,13 @@ def axis_move(Face, AxisFrom, AxisTo, Slice, Cube, D, s):
     # Only perform the second rotation loop for inner moves (i.e. when Slice > 1).
     if Slice > 1:
         z2 = flip(FaceI, s, D - 1, Slice, to - 1)
-        ###print(f"[DEBUG] axis_move(): Computed flipped positions z2: {z2}")
-        for i_idx in range(n_iter):
-            src_idx = int(z[i_idx]) - 1
-            pos_index = int(z2[i_idx]) - 1
-            ###print(f"[DEBUG] axis_move(): Loop2, i_idx={i_idx}, src_idx={src_idx}, pos_index={pos_index}")
-            if pos_index < len(z):
-                k = int(z[pos_index]) - 1
-                ###print(f"[DEBUG] axis_move(): i_idx={i_idx}, Using pos_index to get k: {k}")
-                G.flat[k] = C.flat[src_idx]
-                I_arr.flat[k] = E.flat[src_idx]
-                ###print(f"[DEBUG] axis_move(): i_idx={i_idx}, Assigned G.flat[{k}]={G.flat[k]} from C.flat[{src_idx}] "
-               #       f"and I_arr.flat[{k}]={I_arr.flat[k]} from E.flat[{src_idx}]")
+        _scatter_flipped(G, C, z, z2, n_iter)
+        _scatter_flipped(I_arr, E, z, z2, n_iter)
     
     Cube[AxisFrom - 1] = G
     Cube[AxisTo - 1] = H
     Cube[AxisFrom - 2] = I_arr
     Cube[AxisTo - 2] = J
-    """print(f"[DEBUG] axis_move(): Updated Cube faces:\n"
-          f"Cube[{AxisFrom - 1}] (G):\n{G}\n"
-          f"Cube[{AxisTo - 1}] (H):\n{H}\n"
-          f"Cube[{AxisFrom - 2}] (I_arr):\n{I_arr}\n"
-          f"Cube[{AxisTo - 2}] (J):\n{J}")
-    """
     return Cube
 
 
@@ -301,17 +269,736 @@ def cube_move(Face, AxisFrom, AxisTo, Slice, Cube, D, s):
     """
     Combines the moves into a single cube move.
     """
-    ###print(f"[DEBUG] cube_move() called with Face={Face}, AxisFrom={AxisFrom}, AxisTo={AxisTo}, Slice={Slice}")
     if Slice == 1:
-        ###print(f"[DEBUG] cube_move(): Calling face_move() because Slice==1")
         Cube = face_move(Face, AxisFrom, AxisTo, Slice, Cube, D, s)
-    ###print(f"[DEBUG] cube_move(): Calling other_move()")
     Cube = other_move(Face, AxisFrom, AxisTo, Slice, Cube, D, s)
-    ###print(f"[DEBUG] cube_move(): Calling axis_move()")
     Cube = axis_move(Face, AxisFrom, AxisTo, Slice, Cube, D, s)
-    ###print(f"[DEBUG] cube_move(): Move complete, returning Cube")
     return Cube
 
+# -------------------------
+# Compiled Move Tables
+# -------------------------
+
+def face_shape(D, s):
+    """
+    Shape of a single face: D-1 axes of length s.
+    """
+    return (s,) * (D - 1)
+
+def initial_cube(D, s):
+    """
+    Builds the solved Cube, labelled exactly as in main().
+    """
+    iter_val = 1
+    A = np.array([[1]])
+    for i in range(1, D):
+        B = A.copy()
+        for j in range(1, s):
+            A = cat(i, A, B + iter_val)
+            iter_val = iter_val + s ** (i - 1)
+    return [A + (k - 1) * iter_val for k in range(1, 2 * D + 1)]
+
+def cube_to_vector(Cube):
+    """
+    Flattens a list of faces into one contiguous sticker vector (face after face).
+    """
+    return np.concatenate([np.ravel(face) for face in Cube])
+
+def vector_to_cube(vec, D, s):
+    """
+    Splits a sticker vector back into a list of 2*D faces (views, no copies).
+    """
+    n = s ** (D - 1)
+    shape = face_shape(D, s)
+    return [vec[k * n:(k + 1) * n].reshape(shape) for k in range(2 * D)]
+
+def legal_moves(D, s):
+    """
+    Yields every (Face, AxisFrom, AxisTo, Slice) accepted by main().
+    """
+    for face in range(1, 2 * D + 1):
+        pair = (face + 1) // 2
+        forbidden = {2 * pair - 1, 2 * pair}
+        for axis_from in range(1, 2 * D + 1):
+            if axis_from in forbidden:
+                continue
+            for axis_to in range(1, 2 * D + 1):
+                if axis_to in forbidden:
+                    continue
+                for slice_val in range(1, s + 1):
+                    yield (face, axis_from, axis_to, slice_val)
+
+def compile_move(Face, AxisFrom, AxisTo, Slice, D, s):
+    """
+    Compiles one move into a flat gather index perm, so that applying the
+    move is new_state = state[perm].
+    cube_move only moves stickers around, so running it once on a cube whose
+    stickers hold their own positions records exactly where each one goes.
+    """
+    n = s ** (D - 1)
+    labels = np.arange(2 * D * n, dtype=np.intp)
+    Cube = [face.copy() for face in vector_to_cube(labels, D, s)]
+    Cube = cube_move(Face, AxisFrom, AxisTo, Slice, Cube, D, s)
+    return cube_to_vector(Cube)
+
+class MoveTable:
+    """
+    Every legal move for a given (D, s), compiled once into a row of perms.
+    Moves that cube_move cannot execute are kept in failed with the error.
+    """
+
+    def __init__(self, D, s):
+        self.D = D
+        self.s = s
+        self.n_stickers = 2 * D * s ** (D - 1)
+        self.moves = []
+        self.index = {}
+        self.failed = {}
+        self._generators = None
+        rows = []
+        for move in legal_moves(D, s):
+            try:
+                perm = compile_move(*move, D, s)
+            except Exception as e:
+                self.failed[move] = e
+                continue
+            self.index[move] = len(self.moves)
+            self.moves.append(move)
+            rows.append(perm)
+        self.perms = np.array(rows, dtype=sticker_dtype(self.n_stickers)).reshape(-1, self.n_stickers)
+
+    @classmethod
+    def from_perms(cls, D, s, moves, perms, failed=None):
+        """
+        A MoveTable around already compiled perms, e.g. memory-mapped from a
+        rubiks_layout file, without compiling anything.
+        """
+        table = cls.__new__(cls)
+        table.D = D
+        table.s = s
+        table.n_stickers = 2 * D * s ** (D - 1)
+        table.moves = [tuple(int(x) for x in move) for move in moves]
+        table.index = {move: i for i, move in enumerate(table.moves)}
+        table.failed = dict(failed or {})
+        table.perms = perms
+        table._generators = None
+        if perms.shape != (len(table.moves), table.n_stickers):
+            raise ValueError(f"Expected perms of shape {(len(table.moves), table.n_stickers)}, got {perms.shape}.")
+        return table
+
+    def __len__(self):
+        return len(self.moves)
+
+    def __contains__(self, move):
+        return tuple(move) in self.index
+
+    def move_id(self, move):
+        """
+        Row of perms holding the given move.
+        """
+        move = tuple(move)
+        if move in self.index:
+            return self.index[move]
+        if move in self.failed:
+            raise ValueError(f"Move {move} cannot be executed for D={self.D}, s={self.s}: {self.failed[move]}")
+        raise ValueError(f"Move {move} is not a legal move for D={self.D}, s={self.s}.")
+
+    def perm(self, move):
+        return self.perms[self.move_id(move)]
+
+    def apply(self, move, state):
+        """
+        Applies a single move to a sticker vector with one gather.
+        """
+        return state[self.perms[self.move_id(move)]]
+
+    def apply_sequence(self, moves, state):
+        """
+        Applies a sequence of moves to a sticker vector.
+        """
+        for move in moves:
+            state = state[self.perms[self.move_id(move)]]
+        return state
+
+    def generator_ids(self):
+        """
+        Move ids of the distinct, invertible, non-identity moves, the first of
+        each group with identical perms. The other moves do nothing, repeat
+        one of these, or duplicate and drop stickers, so only these reach
+        puzzle states.
+        """
+        if self._generators is None:
+            identity = np.arange(self.n_stickers)
+            seen = set()
+            ids = []
+            for i, perm in enumerate(self.perms):
+                key = perm.tobytes()
+                if key in seen or not is_permutation(perm) or np.array_equal(perm, identity):
+                    continue
+                seen.add(key)
+                ids.append(i)
+            self._generators = np.array(ids, dtype=np.intp)
+        return self._generators
+
+    def move_ids(self, moves):
+        """
+        Converts a list of move tuples into an array of rows of perms.
+        """
+        return np.array([self.move_id(move) for move in moves], dtype=np.intp)
+
+    def apply_batch(self, moves, states):
+        """
+        Applies moves to every row of an (N, n_stickers) state matrix.
+        moves is either one move tuple, applied to all rows, or a numpy array
+        of N move ids (see move_ids), one per row. Anything else (e.g. a list,
+        which could be read either way) is rejected.
+        """
+        states = np.asarray(states)
+        if isinstance(moves, tuple):
+            return states[:, self.perms[self.move_id(moves)]]
+        if not isinstance(moves, np.ndarray) or moves.dtype.kind not in "iu":
+            raise TypeError("moves must be a move tuple or an integer array of move ids from move_ids().")
+        ids = moves.astype(np.intp, copy=False)
+        if ids.shape != (states.shape[0],):
+            raise ValueError(f"Expected {states.shape[0]} move ids, got shape {ids.shape}.")
+        return np.take_along_axis(states, self.perms[ids], axis=1)
+
+    def apply_sequences_batch(self, sequences, states):
+        """
+        Applies an (N, L) array of move ids to an (N, n_stickers) state
+        matrix, row by row, in L batched gathers.
+        """
+        sequences = np.asarray(sequences, dtype=np.intp)
+        for step in range(sequences.shape[1]):
+            states = self.apply_batch(sequences[:, step], states)
+        return states
+
+    def random_scrambles(self, N, L, rng=None):
+        """
+        Draws N independent scrambles of length L as an (N, L) array of move
+        ids, uniformly over generator_ids().
+        """
+        rng = np.random.default_rng(rng)
+        ids = self.generator_ids()
+        return ids[rng.integers(0, len(ids), size=(N, L))]
+
+    def solved_batch(self, N):
+        """
+        N copies of the solved state as an (N, n_stickers) matrix.
+        """
+        solved = HypercubeState.solved(self.D, self.s).stickers
+        return np.tile(solved, (N, 1))
+
+    def scramble_batch(self, N, L, rng=None):
+        """
+        Returns N scrambled states and the (N, L) scrambles that produced them.
+        """
+        scrambles = self.random_scrambles(N, L, rng)
+        return self.apply_sequences_batch(scrambles, self.solved_batch(N)), scrambles
+
+class LazyMoveTable:
+    """
+    Compiles each move the first time it is applied and keeps its perm, for
+    interactive use on puzzles too large to compile every legal move first.
+    Supports apply and apply_sequence like MoveTable.
+    """
+
+    def __init__(self, D, s):
+        self.D = D
+        self.s = s
+        self.n_stickers = 2 * D * s ** (D - 1)
+        self.perms = {}
+
+    def perm(self, move):
+        move = tuple(move)
+        if move not in self.perms:
+            perm = compile_move(*move, self.D, self.s)
+            self.perms[move] = perm.astype(sticker_dtype(self.n_stickers))
+        return self.perms[move]
+
+    def apply(self, move, state):
+        return state[self.perm(move)]
+
+    def apply_sequence(self, moves, state):
+        for move in moves:
+            state = state[self.perm(move)]
+        return state
+
+_move_tables = {}
+
+def move_table(D, s):
+    """
+    Returns the MoveTable for (D, s), compiling it on first use.
+    """
+    key = (D, s)
+    if key not in _move_tables:
+        _move_tables[key] = MoveTable(D, s)
+    return _move_tables[key]
+
+# -------------------------
+# Cube State
+# -------------------------
+
+def sticker_dtype(n_stickers):
+    """
+    Smallest unsigned dtype that can hold labels 1..n_stickers.
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if n_stickers <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+class HypercubeState:
+    """
+    All stickers of the puzzle in one contiguous, read-only array.
+    Faces are zero-copy views, and moves return a new state.
+    """
+
+    __slots__ = ("D", "s", "stickers", "_hash")
+
+    def __init__(self, stickers, D, s):
+        n_stickers = 2 * D * s ** (D - 1)
+        stickers = np.ascontiguousarray(stickers, dtype=sticker_dtype(n_stickers))
+        if stickers.shape != (n_stickers,):
+            raise ValueError(f"Expected {n_stickers} stickers for D={D}, s={s}, got shape {stickers.shape}.")
+        stickers.flags.writeable = False
+        self.D = D
+        self.s = s
+        self.stickers = stickers
+        self._hash = None
+
+    @classmethod
+    def solved(cls, D, s):
+        return cls(cube_to_vector(initial_cube(D, s)), D, s)
+
+    @classmethod
+    def from_cube(cls, Cube, D, s):
+        return cls(cube_to_vector(Cube), D, s)
+
+    @property
+    def n_stickers(self):
+        return self.stickers.shape[0]
+
+    def face(self, Face):
+        """
+        View of a face, numbered 1 to 2*D as in cube_move.
+        """
+        n = self.s ** (self.D - 1)
+        return self.stickers[(Face - 1) * n:Face * n].reshape(face_shape(self.D, self.s))
+
+    def faces(self):
+        return vector_to_cube(self.stickers, self.D, self.s)
+
+    def to_cube(self):
+        """
+        Copies the state back into the list-of-faces form used by cube_move.
+        """
+        return [face.astype(np.int64) for face in self.faces()]
+
+    def apply(self, move, table=None):
+        if table is None:
+            table = move_table(self.D, self.s)
+        return HypercubeState(table.apply(move, self.stickers), self.D, self.s)
+
+    def apply_sequence(self, moves, table=None):
+        if table is None:
+            table = move_table(self.D, self.s)
+        return HypercubeState(table.apply_sequence(moves, self.stickers), self.D, self.s)
+
+    def is_solved(self):
+        return self == HypercubeState.solved(self.D, self.s)
+
+    def __eq__(self, other):
+        if not isinstance(other, HypercubeState):
+            return NotImplemented
+        return (self.D == other.D and self.s == other.s
+                and np.array_equal(self.stickers, other.stickers))
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash((self.D, self.s, self.stickers.tobytes()))
+        return self._hash
+
+    def __repr__(self):
+        return f"HypercubeState(D={self.D}, s={self.s}, dtype={self.stickers.dtype})"
+
+    def digest(self):
+        """
+        Stable hex digest of the stickers, identical across processes and runs.
+        """
+        return state_digest(self.stickers)
+
+def state_digest(stickers):
+    return hashlib.blake2b(np.ascontiguousarray(stickers).tobytes(), digest_size=16).hexdigest()
+
+# -------------------------
+# Permutation Group
+# -------------------------
+# A compiled move is a gather index: new_state = state[perm]. Applying p
+# then q gives state[p][q] = state[p[q]], so sequences compose left to right.
+
+def compose(*perms):
+    """
+    Composes gather perms in the order they are applied.
+    """
+    result = np.asarray(perms[0])
+    for perm in perms[1:]:
+        result = result[perm]
+    return result
+
+def is_permutation(perm):
+    """
+    True if every sticker position appears exactly once.
+    """
+    perm = np.asarray(perm)
+    return bool(np.array_equal(np.sort(perm), np.arange(perm.shape[0])))
+
+def _require_permutation(perm):
+    if not is_permutation(perm):
+        raise ValueError("Not a permutation: some stickers are duplicated by this move sequence.")
+
+def invert(perm):
+    """
+    Inverse perm, so that compose(perm, invert(perm)) is the identity.
+    """
+    perm = np.asarray(perm)
+    _require_permutation(perm)
+    inverse = np.empty_like(perm)
+    inverse[perm] = np.arange(perm.shape[0], dtype=perm.dtype)
+    return inverse
+
+def cycles(perm, include_fixed=False):
+    """
+    Cycle decomposition of a perm as a list of lists of sticker positions.
+    """
+    perm = np.asarray(perm)
+    _require_permutation(perm)
+    perm_list = perm.tolist()
+    seen = [False] * len(perm_list)
+    result = []
+    for start in range(len(perm_list)):
+        if seen[start]:
+            continue
+        cycle = []
+        i = start
+        while not seen[i]:
+            seen[i] = True
+            cycle.append(i)
+            i = perm_list[i]
+        if include_fixed or len(cycle) > 1:
+            result.append(cycle)
+    return result
+
+def cycle_type(perm):
+    """
+    Sorted lengths of the non-trivial cycles of a perm.
+    """
+    return sorted((len(c) for c in cycles(perm)), reverse=True)
+
+def order(perm):
+    """
+    Number of repetitions of perm that return every sticker to its place,
+    the LCM of its cycle lengths.
+    """
+    return math.lcm(1, *(len(c) for c in cycles(perm)))
+
+def sequence_perm(moves, table):
+    """
+    Composes a list of moves into a single perm.
+    """
+    perm = np.arange(table.n_stickers, dtype=np.intp)
+    for move in moves:
+        perm = perm[table.perms[table.move_id(move)]]
+    return perm
+
+def sequence_order(moves, table):
+    return order(sequence_perm(moves, table))
+
+def commutator(p, q):
+    """
+    The commutator p q p^-1 q^-1 of two perms, applied in that order.
+    """
+    return compose(p, q, invert(p), invert(q))
+
+# -------------------------
+# Canonical Sequences
+# -------------------------
+# A sequence is reduced with rules read off the (Face, AxisFrom, AxisTo,
+# Slice) parameters and then checked against the compiled perms, since not
+# every move of cube_move behaves as its parameters suggest:
+#   - moves that do nothing are dropped, and moves with identical perms are
+#     treated as one;
+#   - every move is a power p**j of a base move p (a quarter turn followed by
+#     its reverse, or four quarter turns of one slice, sum to a power 0 mod the
+#     order of p), so runs of the same base merge into one exponent;
+#   - moves about the same face pair in the same plane on different slices
+#     (parallel slices) commute when their perms do, and commuting moves are
+#     put in increasing order of their base.
+
+def _plane(move):
+    Face, AxisFrom, AxisTo, Slice = move
+    return ((Face + 1) // 2, frozenset(((AxisFrom + 1) // 2, (AxisTo + 1) // 2)))
+
+class Canonicalizer:
+    """
+    Reduces move sequences of a MoveTable to a canonical, shortest equivalent
+    form under the rules above, and gives the matching pruning rule for search.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        perms = table.perms
+        M = len(table.moves)
+        identity = np.arange(table.n_stickers, dtype=perms.dtype)
+        self.identity = np.array([np.array_equal(p, identity) for p in perms], dtype=bool)
+        self.base = np.arange(M, dtype=np.intp)
+        self.power = np.ones(M, dtype=np.int64)
+        self.order = {}
+        by_perm = {}
+        for i in range(M):
+            by_perm.setdefault(perms[i].tobytes(), []).append(i)
+        for i in range(M):
+            if self.identity[i] or self.base[i] != i or self.power[i] != 1:
+                continue
+            if not is_permutation(perms[i]):
+                self.order[i] = 0
+                continue
+            r = order(perms[i])
+            self.order[i] = r
+            q = perms[i]
+            for j in range(1, r):
+                for k in by_perm.get(q.tobytes(), ()):
+                    if k > i and self.base[k] == k and self.power[k] == 1:
+                        self.base[k] = i
+                        self.power[k] = j
+                q = q[perms[i]]
+        self._commuting = set()
+        planes = {}
+        for i in range(M):
+            if not self.identity[i] and self.base[i] == i:
+                planes.setdefault(_plane(table.moves[i]), []).append(i)
+        for group in planes.values():
+            for a in group:
+                for b in group:
+                    if a < b and np.array_equal(perms[a][perms[b]], perms[b][perms[a]]):
+                        self._commuting.add((a, b))
+        self._spellings = {}
+
+    def commute(self, a, b):
+        """
+        True if bases a and b are known to commute.
+        """
+        return a == b or (min(a, b), max(a, b)) in self._commuting
+
+    def spell(self, base, power):
+        """
+        The shortest list of move ids whose product is base**power, using the
+        moves that are powers of base.
+        """
+        r = self.order[base]
+        if r == 0:
+            return [base] * power
+        if base not in self._spellings:
+            steps = {}
+            for k in np.flatnonzero((self.base == base) & ~self.identity):
+                steps.setdefault(int(self.power[k]) % r, int(k))
+            best = {0: []}
+            frontier = [0]
+            while frontier:
+                following = []
+                for e in frontier:
+                    for j, k in steps.items():
+                        f = (e + j) % r
+                        if f not in best:
+                            best[f] = best[e] + [k]
+                            following.append(f)
+                frontier = following
+            self._spellings[base] = best
+        return self._spellings[base][power % r]
+
+    def _push(self, stack, i):
+        b = int(self.base[i])
+        j = len(stack) - 1
+        while j >= 0 and stack[j][0] != b and self.commute(stack[j][0], b):
+            j -= 1
+        if j >= 0 and stack[j][0] == b:
+            r = self.order[b]
+            power = stack[j][1] + int(self.power[i])
+            if r:
+                power %= r
+            if power == 0:
+                del stack[j]
+            else:
+                stack[j] = (b, power)
+            return
+        k = j + 1
+        while k < len(stack) and stack[k][0] < b:
+            k += 1
+        stack.insert(k, (b, int(self.power[i])))
+
+    def reduce_ids(self, ids):
+        """
+        Canonical form of a sequence of move ids.
+        """
+        ids = [int(i) for i in ids if not self.identity[i]]
+        seen = set()
+        while tuple(ids) not in seen:
+            # Spelled-out powers can expose new merges, so repeat to a fixed point.
+            seen.add(tuple(ids))
+            stack = []
+            for i in ids:
+                self._push(stack, i)
+            ids = [k for b, power in stack for k in self.spell(b, power)]
+        return ids
+
+    def reduce(self, moves):
+        """
+        Canonical form of a list of move tuples.
+        """
+        return [self.table.moves[i] for i in self.reduce_ids(self.table.move_ids(moves))]
+
+    def allowed(self, last, move):
+        """
+        Pruning rule for search: False if the move id following last could be
+        dropped, merged or reordered, i.e. the pair is not already canonical.
+        """
+        if last is None:
+            return not self.identity[move]
+        return self.reduce_ids([last, move]) == [last, move]
+
+    def allowed_matrix(self, ids):
+        """
+        allowed(ids[a], ids[b]) for every pair, as a boolean matrix.
+        """
+        return np.array([[self.allowed(a, b) for b in ids] for a in ids], dtype=bool)
+
+_canonicalizers = {}
+
+def canonicalizer(D, s):
+    """
+    Returns the Canonicalizer for (D, s), building it on first use.
+    """
+    key = (D, s)
+    if key not in _canonicalizers:
+        _canonicalizers[key] = Canonicalizer(move_table(D, s))
+    return _canonicalizers[key]
+
+def canonical_moves(moves, D, s):
+    return canonicalizer(D, s).reduce(moves)
+
+# -------------------------
+# Scripted Moves
+# -------------------------
+
+def parse_move(token):
+    """
+    Parses one move written as Face.AxisFrom.AxisTo.Slice, e.g. 1.3.5.2
+    """
+    parts = token.split(".")
+    if len(parts) != 4:
+        raise ValueError(f"Move '{token}' must have the form Face.AxisFrom.AxisTo.Slice")
+    try:
+        return tuple(int(p) for p in parts)
+    except ValueError:
+        raise ValueError(f"Move '{token}' must contain only integers") from None
+
+def parse_moves(text):
+    """
+    Parses a whitespace or comma separated list of moves. '#' starts a comment.
+    """
+    text = text.split("#", 1)[0]
+    return [parse_move(token) for token in text.replace(",", " ").split()]
+
+def format_moves(moves):
+    return " ".join(".".join(str(p) for p in move) for move in moves)
+
+def read_sequences(lines):
+    """
+    Reads one move sequence per line, skipping blank and comment-only lines.
+    """
+    sequences = []
+    for lineno, line in enumerate(lines, start=1):
+        try:
+            moves = parse_moves(line)
+        except ValueError as e:
+            raise ValueError(f"line {lineno}: {e}") from None
+        if moves:
+            sequences.append(moves)
+    return sequences
+
+def run_sequences(sequences, D, s, table=None, canonical=False):
+    """
+    Applies each sequence to a solved cube without prompting, first reducing
+    it to canonical form if canonical is True.
+    Returns the final HypercubeStates, the number of moves and the elapsed seconds.
+    """
+    if table is None:
+        table = move_table(D, s)
+    solved = HypercubeState.solved(D, s).stickers
+    ids = [table.move_ids(moves) for moves in sequences]
+    if canonical:
+        canon = canonicalizer(D, s) if table is _move_tables.get((D, s)) else Canonicalizer(table)
+        ids = [canon.reduce_ids(seq) for seq in ids]
+    n_moves = sum(len(seq) for seq in ids)
+    results = []
+    start = time.perf_counter()
+    for seq in ids:
+        state = solved
+        for i in seq:
+            state = state[table.perms[i]]
+        results.append(state)
+    elapsed = time.perf_counter() - start
+    return [HypercubeState(state, D, s) for state in results], n_moves, elapsed
+
+def run_cli(argv=None):
+    """
+    Non-interactive driver: reads move sequences, one per line, from a file
+    or stdin and prints the final state of each.
+    """
+    parser = argparse.ArgumentParser(description="Apply scripted moves to a higher-dimensional Rubik's cube.")
+    parser.add_argument("-D", type=int, required=True, help="number of dimensions (>= 3)")
+    parser.add_argument("-s", type=int, required=True, help="number of slices per side (>= 2)")
+    parser.add_argument("input", nargs="?", default="-", help="file of move sequences, '-' for stdin")
+    parser.add_argument("--emit", choices=("state", "hash", "none"), default="state",
+                        help="print the final stickers, their digest, or nothing")
+    parser.add_argument("--stats", action="store_true", help="print a throughput summary to stderr")
+    parser.add_argument("--canonical", action="store_true",
+                        help="reduce each sequence to canonical form before running it")
+    args = parser.parse_args(argv)
+    if args.D < 3 or args.s < 2:
+        parser.error("D must be at least 3 and s at least 2")
+
+    try:
+        if args.input == "-":
+            lines = sys.stdin.readlines()
+        else:
+            with open(args.input) as f:
+                lines = f.readlines()
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    try:
+        sequences = read_sequences(lines)
+        start = time.perf_counter()
+        table = move_table(args.D, args.s)
+        compile_time = time.perf_counter() - start
+        states, n_moves, elapsed = run_sequences(sequences, args.D, args.s, table, args.canonical)
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    for state in states:
+        if args.emit == "state":
+            print(" ".join(map(str, state.stickers.tolist())))
+        elif args.emit == "hash":
+            print(state.digest())
+    if args.stats:
+        rate = n_moves / elapsed if elapsed > 0 else float("inf")
+        print(f"{len(states)} sequences, {n_moves} moves in {elapsed:.6f} s "
+              f"({rate:.0f} moves/sec); move table compiled in {compile_time:.3f} s",
+              file=sys.stderr)
+    return 0
+
 # -------------------------
 # Main Program
 # -------------------------
@@ -324,23 +1011,12 @@ def main():
     # Get the number of slices (divisions per side, at least 2)
     s = get_int("Enter the number of slices or divisions per side (>= 2): ", min_val=2)
     
-    iter_val = 1
     # Create the Cube object.
-    # Start with a 2D array so that concatenation mimics MATLAB's behavior.
-    A = np.array([[1]])
-    for i in range(1, D):
-        B = A.copy()
-        for j in range(1, s):
-            A = cat(i, A, B + iter_val)
-            iter_val = iter_val + s ** (i - 1)
-            ###print(f"[DEBUG] main(): Cube creation loop: i={i}, j={j}, iter_val={iter_val}, A=\n{A}")
-    Cube = []
-    for k in range(1, 2 * D + 1):
-        Cube.append(A + (k - 1) * iter_val)
-        ###print(f"[DEBUG] main(): Cube face {k-1} created:\n{Cube[-1]}")
+    state = HypercubeState.solved(D, s)
+    table = LazyMoveTable(D, s)
     
     print("\nInitial Cube:")
-    for face in Cube:
+    for face in state.faces():
         print(face)
     
     print("\nCommands:")
@@ -356,7 +1032,7 @@ def main():
             break
         elif user_cmd == "S":
             print("\nCurrent Cube state:")
-            for face in Cube:
+            for face in state.faces():
                 print(face)
         elif user_cmd == "M":
             print("\nPlease enter the following move parameters:")
@@ -381,15 +1057,14 @@ def main():
                     break
             slice_val = get_int(f"Enter slice (1 to {s}): ", min_val=1, max_val=s)
             try:
-                Cube = cube_move(face, axis_from, axis_to, slice_val, Cube, D, s)
+                state = state.apply((face, axis_from, axis_to, slice_val), table)
                 print("Move executed successfully.")
-                ###print("[DEBUG] main(): Cube state after move:")
-                # for idx, face_array in enumerate(Cube):
-                #     print(f"Face {idx}:\n{face_array}")
             except Exception as e:
                 print(f"Error during move execution: {e}")
         else:
             print("Invalid command. Please enter Q, S, or M.")
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(run_cli())
     main()
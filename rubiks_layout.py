@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Daniel Ketterer
+
+Precomputed index layouts of the hypercube puzzle, one versioned binary file
+per (D, s), opened with numpy memmap. A file holds the solved labelling of
+initial_cube (the nested cat calls) and the compiled perms of every legal
+move, so worker processes share one page-cached copy instead of each
+rebuilding and holding identical tables.
+
+File format: the magic bytes, the format version and the header length as
+little-endian uint32s, a JSON header, then every array at a 64-byte aligned
+offset given in the header:
+
+    labels     (n_stickers,)             solved sticker labels
+    moves      (n_moves, 4)              (Face, AxisFrom, AxisTo, Slice)
+    perms      (n_moves, n_stickers)     gather index of each move
+
+labels and perms use the smallest unsigned dtype that holds n_stickers.
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import rubiks_hypercube
+from rubiks_hypercube import MoveTable, cube_to_vector, initial_cube, sticker_dtype
+
+MAGIC = b"RHLAYOUT"
+# Bump when the format or cube_move changes, so stale files are rebuilt.
+LAYOUT_VERSION = 2
+ALIGN = 64
+
+_PREFIX = struct.Struct("<8sII")
+
+def layout_path(directory, D, s):
+    return os.path.join(directory, f"rubiks_D{D}_s{s}.layout")
+
+# -------------------------
+# Writing
+# -------------------------
+
+def layout_arrays(D, s, table=None):
+    """
+    The arrays stored for (D, s), compiling the MoveTable if none is given.
+    """
+    if table is None:
+        table = MoveTable(D, s)
+    dtype = sticker_dtype(table.n_stickers)
+    return {
+        "labels": cube_to_vector(initial_cube(D, s)).astype(dtype),
+        "moves": np.array(table.moves, dtype=np.int64).reshape(-1, 4),
+        "perms": np.ascontiguousarray(table.perms, dtype=dtype),
+    }, table
+
+def _aligned(n):
+    return -(-n // ALIGN) * ALIGN
+
+def write_layout(path, D, s, table=None):
+    """
+    Writes the layout of (D, s) to path. The file is written next to path
+    and renamed into place, so readers never see a partial layout.
+    """
+    arrays, table = layout_arrays(D, s, table)
+    entries = {}
+    header = {"version": LAYOUT_VERSION, "D": D, "s": s, "n_stickers": table.n_stickers,
+              "failed": [[list(move), str(e)] for move, e in table.failed.items()],
+              "arrays": entries}
+    # Offsets depend on the header's length, which depends on the offsets;
+    # reserve room for them by iterating until the header stops growing.
+    size = 0
+    while True:
+        offset = _aligned(_PREFIX.size + size)
+        for name, arr in arrays.items():
+            entries[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+            offset = _aligned(offset + arr.nbytes)
+        text = json.dumps(header).encode()
+        if len(text) <= size:
+            break
+        size = len(text)
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_PREFIX.pack(MAGIC, LAYOUT_VERSION, size))
+            f.write(text.ljust(size))
+            for name, arr in arrays.items():
+                f.seek(entries[name]["offset"])
+                f.write(arr.tobytes())
+        # mkstemp creates the file readable by its owner only; give it the
+        # permissions open() would, so other users' workers can map it.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return path
+
+# -------------------------
+# Reading
+# -------------------------
+
+class Layout:
+    """
+    A layout file opened read-only, its arrays as numpy memmaps.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            prefix = f.read(_PREFIX.size)
+            if len(prefix) < _PREFIX.size:
+                raise ValueError(f"{path}: not a layout file")
+            magic, version, size = _PREFIX.unpack(prefix)
+            if magic != MAGIC:
+                raise ValueError(f"{path}: not a layout file")
+            if version != LAYOUT_VERSION:
+                raise ValueError(f"{path}: layout version {version}, expected {LAYOUT_VERSION}")
+            header = json.loads(f.read(size))
+        self.header = header
+        self.D = header["D"]
+        self.s = header["s"]
+        self.n_stickers = header["n_stickers"]
+        self.arrays = {}
+        for name, entry in header["arrays"].items():
+            shape = tuple(entry["shape"])
+            if 0 in shape:
+                self.arrays[name] = np.empty(shape, dtype=entry["dtype"])
+            else:
+                self.arrays[name] = np.memmap(path, dtype=entry["dtype"], mode="r",
+                                              offset=entry["offset"], shape=shape)
+        self.labels = self.arrays["labels"]
+        self.moves = self.arrays["moves"]
+        self.perms = self.arrays["perms"]
+
+    def move_table(self):
+        """
+        A MoveTable whose perms are the memory-mapped rows of this file.
+        """
+        failed = {tuple(move): message for move, message in self.header["failed"]}
+        return MoveTable.from_perms(self.D, self.s, self.moves, self.perms, failed)
+
+    def solved(self):
+        return rubiks_hypercube.HypercubeState(self.labels, self.D, self.s)
+
+def open_layout(directory, D, s, build=True):
+    """
+    The Layout of (D, s) in directory. A missing file, or one written by an
+    older version, is built first when build is True.
+    """
+    path = layout_path(directory, D, s)
+    try:
+        layout = Layout(path)
+    except (FileNotFoundError, ValueError):
+        if not build:
+            raise
+        write_layout(path, D, s)
+        layout = Layout(path)
+    if (layout.D, layout.s) != (D, s):
+        raise ValueError(f"{path}: holds D={layout.D}, s={layout.s}, expected D={D}, s={s}")
+    return layout
+
+def load_move_table(directory, D, s, build=True):
+    """
+    Installs the memory-mapped MoveTable of (D, s) as the one move_table(D, s)
+    returns in this process, so the solver and scripted runs use it too, and
+    drops any Canonicalizer built on the table it replaces.
+    Call once at worker start.
+    """
+    table = open_layout(directory, D, s, build).move_table()
+    rubiks_hypercube._move_tables[(D, s)] = table
+    rubiks_hypercube._canonicalizers.pop((D, s), None)
+    return table
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build memory-mapped puzzle layouts.")
+    parser.add_argument("-D", type=int, nargs="+", required=True, help="dimensions")
+    parser.add_argument("-s", type=int, nargs="+", required=True, help="slices per side")
+    parser.add_argument("--dir", default="layouts", help="directory of the layout files")
+    parser.add_argument("--force", action="store_true", help="rebuild existing files")
+    args = parser.parse_args(argv)
+
+    for D in args.D:
+        for s in args.s:
+            path = layout_path(args.dir, D, s)
+            start = time.perf_counter()
+            if args.force or not os.path.exists(path):
+                write_layout(path, D, s)
+            layout = open_layout(args.dir, D, s)
+            print(f"D={D} s={s}: {len(layout.moves)} moves, {layout.n_stickers} stickers, "
+                  f"{os.path.getsize(path)/2**20:.1f} MiB in {time.perf_counter() - start:.2f} s -> {path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Daniel Ketterer
+
+Instrumentation for the rubiks_hypercube move internals. While a Profiler is
+active it swaps the module's functions for timing wrappers, and restores the
+originals when it stops, so nothing is paid when profiling is off and no
+source has to be edited. Records per-function and per-phase timers, call
+counters and (optionally) allocations per move, exported as JSON, folded
+stacks for flamegraph.pl / speedscope, or a Chrome trace.
+
+Only calls made through the module are seen, e.g.
+rubiks_hypercube.cube_move(...) or MoveTable methods, not names bound by
+"from rubiks_hypercube import cube_move" before profiling started.
+"""
+import argparse
+import functools
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import rubiks_hypercube
+
+# Function name -> phase. Names with a dot are methods of a class in the module.
+PHASES = {
+    "cube_move": "move",
+    "face_move": "face rotation",
+    "other_move": "slice rotation",
+    "axis_move": "axis rotation",
+    "rotdim": "face rotation",
+    "position": "index generation",
+    "flip": "index generation",
+    "cat": "index generation",
+    "_gather": "sticker gather/scatter",
+    "_scatter": "sticker gather/scatter",
+    "_scatter_flipped": "sticker gather/scatter",
+    "_copy": "copies",
+    "compile_move": "compile",
+    "MoveTable.apply": "compiled gather",
+    "MoveTable.apply_sequence": "compiled gather",
+    "MoveTable.apply_batch": "compiled gather",
+}
+
+def _new_stats():
+    return {"calls": 0, "total": 0.0, "self": 0.0, "min": float("inf"), "max": 0.0}
+
+class Profiler:
+    """
+    Collects timings of the functions in PHASES (or a given subset).
+    Use as a context manager, or call start() and stop().
+    allocations=True also records, per outermost instrumented call, the peak
+    traced bytes and the net allocated blocks; trace=True keeps every call as
+    an event for chrome_trace().
+    """
+
+    def __init__(self, functions=None, allocations=False, trace=False):
+        self.functions = list(PHASES if functions is None else functions)
+        self.allocations = allocations
+        self.trace = trace
+        self.reset()
+        self._saved = []
+
+    def reset(self):
+        self.stats = {}
+        self.folded = {}
+        self.counters = {}
+        self.memory = {}
+        self.events = []
+        self._stack = []
+        self._origin = time.perf_counter()
+
+    # -------------------------
+    # Patching
+    # -------------------------
+
+    def start(self):
+        if self._saved:
+            raise RuntimeError("profiler already started")
+        for name in self.functions:
+            owner, attr = self._owner(name)
+            original = getattr(owner, attr)
+            self._saved.append((owner, attr, original))
+            setattr(owner, attr, self._wrap(name, original))
+        if self.allocations:
+            tracemalloc.start()
+        return self
+
+    def stop(self):
+        for owner, attr, original in reversed(self._saved):
+            setattr(owner, attr, original)
+        self._saved = []
+        if self.allocations:
+            tracemalloc.stop()
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _owner(self, name):
+        if name not in PHASES:
+            raise ValueError(f"unknown function {name!r}; choose from {sorted(PHASES)}")
+        parts = name.split(".")
+        owner = rubiks_hypercube
+        for part in parts[:-1]:
+            owner = getattr(owner, part)
+        return owner, parts[-1]
+
+    def _wrap(self, name, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            self._enter(name)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._exit()
+        return wrapper
+
+    # -------------------------
+    # Recording
+    # -------------------------
+
+    def _enter(self, name):
+        outer = not self._stack and self.allocations
+        if outer:
+            tracemalloc.reset_peak()
+            memory = (tracemalloc.get_traced_memory()[0], sys.getallocatedblocks())
+        else:
+            memory = None
+        self._stack.append([name, time.perf_counter(), 0.0, memory])
+
+    def _exit(self):
+        end = time.perf_counter()
+        name, begin, children, memory = self._stack.pop()
+        elapsed = end - begin
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = _new_stats()
+        stats["calls"] += 1
+        stats["total"] += elapsed
+        stats["self"] += elapsed - children
+        stats["min"] = min(stats["min"], elapsed)
+        stats["max"] = max(stats["max"], elapsed)
+        key = ";".join([frame[0] for frame in self._stack] + [name])
+        self.folded[key] = self.folded.get(key, 0.0) + elapsed - children
+        if self._stack:
+            self._stack[-1][2] += elapsed
+        if memory is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            mem = self.memory.setdefault(name, {"calls": 0, "peak_bytes": 0, "transient_bytes": 0, "net_blocks": 0})
+            mem["calls"] += 1
+            mem["peak_bytes"] = max(mem["peak_bytes"], peak - memory[0])
+            mem["transient_bytes"] += peak - memory[0]
+            mem["net_blocks"] += sys.getallocatedblocks() - memory[1]
+        if self.trace:
+            self.events.append((name, begin - self._origin, elapsed, len(self._stack)))
+
+    def count(self, name, n=1):
+        """
+        Adds n to a named counter, for counts outside the wrapped functions.
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    # -------------------------
+    # Export
+    # -------------------------
+
+    def phases(self):
+        """
+        Exclusive (self) time and calls per phase.
+        """
+        out = {}
+        for name, stats in self.stats.items():
+            phase = out.setdefault(PHASES[name], {"calls": 0, "self": 0.0})
+            phase["calls"] += stats["calls"]
+            phase["self"] += stats["self"]
+        return out
+
+    def report(self):
+        functions = {}
+        for name, stats in sorted(self.stats.items(), key=lambda item: -item[1]["self"]):
+            row = dict(stats, phase=PHASES[name], mean_us=1e6*stats["total"]/stats["calls"])
+            if name in self.memory:
+                mem = self.memory[name]
+                row["peak_bytes"] = mem["peak_bytes"]
+                row["transient_bytes_per_call"] = mem["transient_bytes"]/mem["calls"]
+                row["net_blocks_per_call"] = mem["net_blocks"]/mem["calls"]
+            functions[name] = row
+        return {"functions": functions, "phases": self.phases(), "counters": dict(self.counters)}
+
+    def to_json(self, path=None):
+        text = json.dumps(self.report(), indent=1)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+    def folded_stacks(self):
+        """
+        Lines "outer;inner self_microseconds", the folded format of flamegraph.pl.
+        """
+        return [f"{key} {round(1e6*value)}" for key, value in sorted(self.folded.items())]
+
+    def chrome_trace(self):
+        """
+        The recorded events (trace=True) in Chrome's trace event format.
+        """
+        return {"traceEvents": [
+            {"name": name, "cat": PHASES[name], "ph": "X", "ts": 1e6*begin, "dur": 1e6*elapsed,
+             "pid": 0, "tid": 0, "args": {"depth": depth}}
+            for name, begin, elapsed, depth in self.events]}
+
+def profile(functions=None, allocations=False, trace=False):
+    """
+    A Profiler ready to be used as a context manager.
+    """
+    return Profiler(functions, allocations, trace)
+
+# -------------------------
+# Command Line
+# -------------------------
+
+def profile_moves(D, s, count=100, seed=0, allocations=False, trace=False):
+    """
+    Runs count random legal moves through cube_move under a profiler and
+    returns it. Moves cube_move cannot execute are counted as failed.
+    """
+    moves = list(rubiks_hypercube.legal_moves(D, s))
+    rng = np.random.default_rng(seed)
+    Cube = rubiks_hypercube.initial_cube(D, s)
+    prof = Profiler(allocations=allocations, trace=trace)
+    with prof:
+        for i in rng.integers(0, len(moves), size=count):
+            try:
+                Cube = rubiks_hypercube.cube_move(*moves[i], [face.copy() for face in Cube], D, s)
+                prof.count("moves")
+            except Exception:
+                prof.count("failed moves")
+    return prof
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile rubiks_hypercube moves.")
+    parser.add_argument("-D", type=int, default=4, help="dimensions")
+    parser.add_argument("-s", type=int, default=3, help="slices per side")
+    parser.add_argument("--moves", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--allocations", action="store_true", help="record allocations per move")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--folded", help="write folded stacks to this file")
+    parser.add_argument("--trace", help="write a Chrome trace to this file")
+    args = parser.parse_args(argv)
+
+    prof = profile_moves(args.D, args.s, args.moves, args.seed, args.allocations, args.trace is not None)
+    report = prof.report()
+    for name, row in report["functions"].items():
+        print(f"{name:<26} {row['phase']:<24} {row['calls']:>8} calls "
+              f"{1e3*row['self']:>10.2f} ms self {row['mean_us']:>10.1f} us/call")
+    print(report["counters"])
+    if args.json:
+        prof.to_json(args.json)
+    if args.folded:
+        with open(args.folded, "w") as f:
+            f.write("\n".join(prof.folded_stacks()) + "\n")
+    if args.trace:
+        with open(args.trace, "w") as f:
+            json.dump(prof.chrome_trace(), f)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Daniel Ketterer
+
+State-space search for small higher-dimensional Rubik's cubes (e.g. D=3 or 4
+with s=2): layered and bidirectional BFS over packed states, and IDA* guided
+by pattern databases stored on disk.
+"""
+import math
+import multiprocessing
+
+import numpy as np
+
+from rubiks_hypercube import HypercubeState, canonicalizer, invert, move_table
+
+# -------------------------
+# Generators
+# -------------------------
+
+def generators(table):
+    """
+    The distinct, invertible, non-identity moves of a MoveTable (see
+    MoveTable.generator_ids). Returns the list of moves and an
+    (M, n_stickers) array of their perms.
+    """
+    ids = table.generator_ids()
+    return [table.moves[i] for i in ids], np.array(table.perms[ids], dtype=np.intp).reshape(-1, table.n_stickers)
+
+# -------------------------
+# Packed States
+# -------------------------
+# A state is packed into label_bits(n) bits per sticker and stored as a
+# fixed-width bytes ('S') array, which numpy can sort, deduplicate and
+# search without any Python objects per state.
+
+def label_bits(n_stickers):
+    return max(1, math.ceil(math.log2(n_stickers + 1)))
+
+def packed_width(n_stickers):
+    return math.ceil(n_stickers * label_bits(n_stickers) / 8)
+
+# Rows are packed in blocks so the one-byte-per-bit planes np.packbits needs
+# stay small next to the packed keys.
+PACK_BLOCK = 1 << 16
+
+def pack_states(states):
+    """
+    Packs an (N, n_stickers) state matrix into an array of N fixed-width keys.
+    """
+    states = np.asarray(states)
+    N, n = states.shape
+    bits = label_bits(n)
+    packed = np.empty((N, packed_width(n)), dtype=np.uint8)
+    for start in range(0, N, PACK_BLOCK):
+        block = states[start:start + PACK_BLOCK]
+        bitplanes = np.empty(block.shape + (bits,), dtype=np.uint8)
+        for b in range(bits):
+            bitplanes[:, :, b] = (block >> b) & 1
+        packed[start:start + PACK_BLOCK] = np.packbits(bitplanes.reshape(block.shape[0], n * bits), axis=1)
+    return packed.view(f"S{packed.shape[1]}").ravel()
+
+def unpack_states(keys, n_stickers, dtype=np.uint8):
+    """
+    Inverse of pack_states.
+    """
+    bits = label_bits(n_stickers)
+    width = packed_width(n_stickers)
+    raw = np.ascontiguousarray(keys).view(np.uint8).reshape(-1, width)
+    states = np.zeros((raw.shape[0], n_stickers), dtype=dtype)
+    for start in range(0, raw.shape[0], PACK_BLOCK):
+        bitplanes = np.unpackbits(raw[start:start + PACK_BLOCK], axis=1)[:, :n_stickers * bits]
+        bitplanes = bitplanes.reshape(-1, n_stickers, bits)
+        block = states[start:start + PACK_BLOCK]
+        for b in range(bits):
+            block |= bitplanes[:, :, b].astype(dtype) << b
+    return states
+
+def contains(sorted_keys, keys):
+    """
+    Membership of keys in a sorted key array.
+    """
+    if sorted_keys.shape[0] == 0:
+        return np.zeros(keys.shape[0], dtype=bool)
+    idx = np.searchsorted(sorted_keys, keys)
+    idx[idx == sorted_keys.shape[0]] = 0
+    return sorted_keys[idx] == keys
+
+def contains_any(sorted_arrays, keys):
+    """
+    Membership of keys in any of several sorted key arrays (e.g. BFS layers).
+    """
+    found = np.zeros(keys.shape[0], dtype=bool)
+    for sorted_keys in sorted_arrays:
+        found |= contains(sorted_keys, keys)
+    return found
+
+def merge(sorted_keys, new_keys):
+    """
+    Adds a set of new keys, disjoint from sorted_keys, keeping the array sorted.
+    """
+    merged = np.concatenate((sorted_keys, new_keys))
+    merged.sort(kind="stable")
+    return merged
+
+# -------------------------
+# Frontier Expansion
+# -------------------------
+
+_worker = {}
+
+def _init_worker(perms, n_stickers, dtype):
+    _worker["perms"] = perms
+    _worker["n_stickers"] = n_stickers
+    _worker["dtype"] = dtype
+
+def _expand_chunk(keys):
+    """
+    Applies every perm to a chunk of packed states; returns the unique children.
+    """
+    perms = _worker["perms"]
+    states = unpack_states(keys, _worker["n_stickers"], _worker["dtype"])
+    children = states[:, perms].reshape(-1, states.shape[1])
+    return np.unique(pack_states(children))
+
+def expand(keys, perms, n_stickers, dtype, pool=None, chunk_size=1 << 20, visited=()):
+    """
+    The unique children of a packed frontier under the given perms that are
+    in none of the sorted key arrays in visited, spread over a
+    multiprocessing pool when one is given. chunk_size bounds the children
+    generated at once, and each chunk is filtered and merged into the result
+    as it arrives, so only new states are held for the whole frontier.
+    """
+    step = max(1, chunk_size // max(1, perms.shape[0]))
+    chunks = (keys[i:i + step] for i in range(0, keys.shape[0], step))
+    if pool is None:
+        _init_worker(perms, n_stickers, dtype)
+        results = map(_expand_chunk, chunks)
+    else:
+        results = pool.imap(_expand_chunk, chunks)
+    found = keys[:0]
+    for children in results:
+        children = children[~contains_any(visited, children)]
+        found = merge(found, children[~contains(found, children)])
+    return found
+
+def _pattern_chunk(task):
+    """
+    The predecessor placements of a chunk of pattern keys, with repeats.
+    """
+    keys, radix = task
+    pos = (keys[:, None] // radix) % _worker["n_stickers"]
+    # A move sends the sticker at position p to invert(perm)[p], so the
+    # predecessors of a placement are reached through perm itself.
+    perms = _worker["perms"]
+    preds = np.zeros((perms.shape[0], keys.shape[0]), dtype=np.int64)
+    for j in range(radix.shape[0]):
+        preds += perms[:, pos[:, j]] * radix[j]
+    return preds.ravel()
+
+def _pool(processes, perms, n_stickers, dtype):
+    if processes is None or processes <= 1:
+        return None
+    return multiprocessing.get_context().Pool(
+        processes, initializer=_init_worker, initargs=(perms, n_stickers, dtype))
+
+# -------------------------
+# Breadth-First Search
+# -------------------------
+
+def bfs_layers(D, s, start=None, max_depth=None, processes=None):
+    """
+    Layered BFS from start (solved by default). Returns one sorted packed key
+    array per depth; with no max_depth the number of layers minus one is the
+    God's number of the generator set.
+    """
+    table = move_table(D, s)
+    _, perms = generators(table)
+    if start is None:
+        start = HypercubeState.solved(D, s)
+    dtype = start.stickers.dtype
+    frontier = pack_states(start.stickers[None, :])
+    layers = [frontier]
+    pool = _pool(processes, perms, table.n_stickers, dtype)
+    try:
+        while frontier.shape[0] and (max_depth is None or len(layers) <= max_depth):
+            # The layers are sorted and disjoint, so they are the visited set.
+            frontier = expand(frontier, perms, table.n_stickers, dtype, pool, visited=layers)
+            if frontier.shape[0] == 0:
+                break
+            layers.append(frontier)
+    finally:
+        if pool is not None:
+            pool.close()
+    return layers
+
+def distance_distribution(D, s, max_depth=None, processes=None):
+    """
+    Number of states at each distance from solved.
+    """
+    return [layer.shape[0] for layer in bfs_layers(D, s, max_depth=max_depth, processes=processes)]
+
+def _find_layer(layers, key):
+    for depth, layer in enumerate(layers):
+        if contains(layer, np.array([key]))[0]:
+            return depth
+    raise ValueError("State not found in search layers.")
+
+def _walk(key, depth, layers, step_perms, n_stickers, dtype):
+    """
+    Follows layers back to depth 0, returning the generator indices used.
+    step_perms[g] maps a state in layer d to its neighbour in layer d-1.
+    """
+    state = unpack_states(np.array([key]), n_stickers, dtype)[0]
+    path = []
+    for d in range(depth, 0, -1):
+        candidates = pack_states(state[step_perms])
+        hit = np.flatnonzero(contains(layers[d - 1], candidates))
+        g = int(hit[0])
+        path.append(g)
+        state = state[step_perms[g]]
+    return path
+
+def bidirectional_search(state, max_depth=20, processes=None):
+    """
+    Shortest solution of a HypercubeState by BFS from both the state and
+    solved, meeting in the middle. Returns a list of moves, or None if no
+    solution exists within max_depth.
+    """
+    D, s = state.D, state.s
+    table = move_table(D, s)
+    moves, perms = generators(table)
+    inverses = np.array([invert(perm) for perm in perms], dtype=np.intp).reshape(perms.shape)
+    n, dtype = table.n_stickers, state.stickers.dtype
+    goal = HypercubeState.solved(D, s)
+    if state == goal:
+        return []
+
+    sides = {
+        "fwd": {"layers": [pack_states(state.stickers[None, :])], "perms": perms},
+        "bwd": {"layers": [pack_states(goal.stickers[None, :])], "perms": inverses},
+    }
+    for side in sides.values():
+        side["pool"] = _pool(processes, side["perms"], n, dtype)
+    meet = None
+    try:
+        depth = 0
+        while depth < max_depth:
+            depth += 1
+            name = min(sides, key=lambda k: sides[k]["layers"][-1].shape[0])
+            side, other = sides[name], sides["bwd" if name == "fwd" else "fwd"]
+            frontier = expand(side["layers"][-1], side["perms"], n, dtype, side["pool"],
+                              visited=side["layers"])
+            if frontier.shape[0] == 0:
+                return None
+            side["layers"].append(frontier)
+            hits = frontier[contains_any(other["layers"], frontier)]
+            if hits.shape[0]:
+                meet = hits[0]
+                break
+    finally:
+        for side in sides.values():
+            if side["pool"] is not None:
+                side["pool"].close()
+    if meet is None:
+        return None
+
+    fwd, bwd = sides["fwd"]["layers"], sides["bwd"]["layers"]
+    # Forward layers are walked back with inverse moves, backward layers
+    # towards solved with the moves themselves.
+    first = _walk(meet, _find_layer(fwd, meet), fwd, inverses, n, dtype)[::-1]
+    second = _walk(meet, _find_layer(bwd, meet), bwd, perms, n, dtype)
+    return [moves[g] for g in first + second]
+
+# -------------------------
+# Pattern Databases
+# -------------------------
+
+UNKNOWN = 255
+
+class PatternDatabase:
+    """
+    Exact distance to solved for the positions of a few sticker labels.
+    Entry sum(pos[j] * n**j) of table is the number of moves needed to bring
+    labels[j] from position pos[j] home, which is an admissible IDA* bound.
+    """
+
+    def __init__(self, D, s, labels, table):
+        self.D = D
+        self.s = s
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.table = table
+        self.n_stickers = 2 * D * s ** (D - 1)
+        self.radix = self.n_stickers ** np.arange(len(self.labels), dtype=np.int64)
+
+    @classmethod
+    def build(cls, D, s, labels, processes=None, pool=None, chunk_size=1 << 20):
+        """
+        Backward BFS from the solved pattern over all n_stickers**k placements.
+        Like expand, the frontier is expanded in chunks of at most chunk_size
+        predecessors, over a multiprocessing pool when processes > 1 (or on
+        pool, one made by _pool over the generators of (D, s)). Each chunk is
+        marked in the distance table as it arrives, which also removes
+        repeats, and the next frontier is read back from it.
+        """
+        table = move_table(D, s)
+        _, perms = generators(table)
+        n = table.n_stickers
+        k = len(labels)
+        solved = HypercubeState.solved(D, s).stickers
+        home = np.array([np.flatnonzero(solved == label)[0] for label in labels], dtype=np.int64)
+        radix = n ** np.arange(k, dtype=np.int64)
+        dist = np.full(n ** k, UNKNOWN, dtype=np.uint8)
+        frontier = np.array([home @ radix], dtype=np.int64)
+        dist[frontier] = 0
+        step = max(1, chunk_size // max(1, perms.shape[0]))
+        own = pool is None
+        if own:
+            pool = _pool(processes, perms, n, solved.dtype)
+        try:
+            depth = 0
+            while frontier.shape[0]:
+                depth += 1
+                if depth >= UNKNOWN:
+                    raise ValueError("Pattern database depth exceeds its uint8 storage.")
+                chunks = ((frontier[i:i + step], radix) for i in range(0, frontier.shape[0], step))
+                if pool is None:
+                    _init_worker(perms, n, solved.dtype)
+                    results = map(_pattern_chunk, chunks)
+                else:
+                    results = pool.imap(_pattern_chunk, chunks)
+                for preds in results:
+                    dist[preds[dist[preds] == UNKNOWN]] = depth
+                frontier = np.flatnonzero(dist == depth)
+        finally:
+            if own and pool is not None:
+                pool.close()
+        return cls(D, s, labels, dist)
+
+    def save(self, path):
+        np.savez(path, table=self.table, labels=self.labels, D=self.D, s=self.s)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(int(data["D"]), int(data["s"]), data["labels"], data["table"])
+
+    def lookup(self, where):
+        """
+        Heuristic for a state given its label -> position map.
+        """
+        value = self.table[where[self.labels] @ self.radix]
+        return math.inf if value == UNKNOWN else int(value)
+
+def default_patterns(D, s, k=4, count=2):
+    """
+    Disjoint groups of k sticker labels, taken in solved order.
+    """
+    solved = HypercubeState.solved(D, s).stickers.astype(np.int64)
+    return [solved[i * k:(i + 1) * k] for i in range(count)]
+
+def build_pattern_databases(D, s, patterns=None, processes=None):
+    if patterns is None:
+        patterns = default_patterns(D, s)
+    _, perms = generators(move_table(D, s))
+    pool = _pool(processes, perms, 2 * D * s ** (D - 1), HypercubeState.solved(D, s).stickers.dtype)
+    try:
+        return [PatternDatabase.build(D, s, labels, pool=pool) for labels in patterns]
+    finally:
+        if pool is not None:
+            pool.close()
+
+# -------------------------
+# IDA*
+# -------------------------
+
+def ida_star(state, pdbs, max_depth=20):
+    """
+    Optimal solution of a HypercubeState by iterative-deepening A*, bounded by
+    the maximum over the pattern databases. Returns a list of moves, or None.
+    Move pairs that are not in canonical order (see Canonicalizer) are pruned.
+    """
+    table = move_table(state.D, state.s)
+    moves, perms = generators(table)
+    allowed = canonicalizer(state.D, state.s).allowed_matrix([table.index[move] for move in moves])
+    goal = HypercubeState.solved(state.D, state.s).stickers
+    positions = np.arange(table.n_stickers, dtype=np.int64)
+    where = np.empty(table.n_stickers + 1, dtype=np.int64)
+
+    def heuristic(stickers):
+        where[stickers] = positions
+        return max((pdb.lookup(where) for pdb in pdbs), default=0)
+
+    path = []
+
+    def search(stickers, g, bound):
+        f = g + heuristic(stickers)
+        if f > bound:
+            return f
+        if np.array_equal(stickers, goal):
+            return True
+        minimum = math.inf
+        for i in range(perms.shape[0]):
+            if path and not allowed[path[-1], i]:
+                continue
+            path.append(i)
+            t = search(stickers[perms[i]], g + 1, bound)
+            if t is True:
+                return True
+            minimum = min(minimum, t)
+            path.pop()
+        return minimum
+
+    bound = heuristic(state.stickers)
+    while bound <= max_depth:
+        t = search(state.stickers, 0, bound)
+        if t is True:
+            return [moves[i] for i in path]
+        if t == math.inf:
+            return None
+        bound = t
+    return None